@@ -2,6 +2,7 @@ import argparse
 from pathlib import Path
 
 from pythonlib.games import ToolsNDX, ToolsTOR, ToolsTOH
+from pythonlib.utils.parallel import shutdown_executors
 
 SCRIPT_VERSION = "0.0.3"
 
@@ -72,6 +73,16 @@ def get_arguments(argv=None):
         help="(Optional) - Insert only changed files not yet commited",
     )
 
+    sp_extract.add_argument(
+        "-j",
+        "--jobs",
+        required=False,
+        type=int,
+        default=1,
+        metavar="jobs",
+        help="(Optional) - Number of processes used to compress/decompress the archive files",
+    )
+
     sp_insert = sp.add_parser(
         "insert",
         help="Take the new texts and recreate the files",
@@ -147,6 +158,23 @@ def get_arguments(argv=None):
         help="(Optional) - Insert only changed files not yet commited",
     )
 
+    sp_insert.add_argument(
+        "--incremental",
+        required=False,
+        action="store_true",
+        help="(Optional) - Patch the previous build instead of creating a new iso (TOR)",
+    )
+
+    sp_insert.add_argument(
+        "-j",
+        "--jobs",
+        required=False,
+        type=int,
+        default=1,
+        metavar="jobs",
+        help="(Optional) - Number of processes used to compress/decompress the archive files",
+    )
+
     args = parser.parse_args()
 
     return args
@@ -208,16 +236,16 @@ if __name__ == "__main__":
                 tales_instance.make_iso(Path(args.iso))
 
             elif args.file_type == "Skits":
-                tales_instance.pack_all_skits()
+                tales_instance.pack_all_skits(jobs=args.jobs)
 
             elif args.file_type == "Story":
                 tales_instance.pack_all_story()
 
             elif args.file_type == "All":
-                tales_instance.pack_all_skits()
+                tales_instance.pack_all_skits(jobs=args.jobs)
                 tales_instance.pack_all_story()
                 tales_instance.pack_all_menu()
-                tales_instance.save_iso(Path(args.iso))
+                tales_instance.save_iso(Path(args.iso), jobs=args.jobs)
                 tales_instance.update_save_file(Path(args.des), args.save)
 
         elif args.file_type == "Main":
@@ -240,7 +268,10 @@ if __name__ == "__main__":
             tales_instance.pack_all_skits()
             tales_instance.pack_all_menu()
             tales_instance.patch_binaries()
-            tales_instance.make_iso()
+            if args.incremental:
+                tales_instance.make_iso_incremental(jobs=args.jobs)
+            else:
+                tales_instance.make_iso(jobs=args.jobs)
 
 
     if args.action == "extract":
@@ -257,17 +288,17 @@ if __name__ == "__main__":
                 tales_instance.decompress_overlays()
 
             if args.file_type == "Skits":
-                tales_instance.extract_all_skits(args.replace)
+                tales_instance.extract_all_skits(args.replace, jobs=args.jobs)
 
             elif args.file_type == "Story":
-                tales_instance.extract_all_story(args.replace)
+                tales_instance.extract_all_story(args.replace, jobs=args.jobs)
         else:
             if args.file_type == "Iso":
                 tales_instance.extract_Iso(Path(args.iso))
-                tales_instance.extract_main_archive()
+                tales_instance.extract_main_archive(jobs=args.jobs)
 
             if args.file_type == "Main":
-                tales_instance.extract_main_archive()
+                tales_instance.extract_main_archive(jobs=args.jobs)
 
             if args.file_type == "Menu":
                 tales_instance.extract_all_menu()
@@ -277,3 +308,5 @@ if __name__ == "__main__":
 
             if args.file_type == "Skits":
                 tales_instance.extract_all_skits(args.replace)
+
+    shutdown_executors()
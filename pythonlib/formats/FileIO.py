@@ -1,58 +1,280 @@
+import array
 import io
+import mmap
+import os
 import struct
+import sys
 from io import BytesIO
 from pathlib import Path
-from typing import Union
+from typing import Optional, Union
+
+# array typecodes with the same size as the struct format characters
+ARRAY_TYPES = {"b": "b", "B": "B", "h": "h", "H": "H", "i": "i", "I": "I", "l": "i", "L": "I",
+               "q": "q", "Q": "Q", "f": "f", "d": "d"}
+NATIVE_ENDIAN = "<" if sys.byteorder == "little" else ">"
+
+# Precompiled structs, one cache per endian
+STRUCTS: dict[str, dict[str, struct.Struct]] = {"<": {}, ">": {}}
+
+# Files opened read only above this size are mapped instead of read
+MMAP_THRESHOLD = 16 * 1024 * 1024
+
+
+class MemoryReader(object):
+    # Read only file over a buffer (bytes, memoryview, mmap...), reads give
+    # bytes like a file and views of the buffer can be taken without copies
+    def __init__(self, buffer, owned: tuple = ()):
+        self.view = memoryview(buffer).cast("B")
+        self.pos = 0
+        self.owned = owned
+
+    def read_view(self, n=-1) -> memoryview:
+        end = len(self.view) if n is None or n < 0 else min(self.pos + n, len(self.view))
+        ret = self.view[self.pos:end]
+        self.pos = max(self.pos, end)
+        return ret
+
+    def view_at(self, pos, n=-1) -> memoryview:
+        return self.view[pos:] if n is None or n < 0 else self.view[pos:pos + n]
+
+    def read(self, n=-1) -> bytes:
+        return self.read_view(n).tobytes()
+
+    def getbuffer(self) -> memoryview:
+        # Same as BytesIO.getbuffer
+        return self.view[:]
+
+    def readinto(self, b) -> int:
+        data = self.read_view(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+    def seek(self, pos, whence=0):
+        if whence == 1:
+            pos += self.pos
+        elif whence == 2:
+            pos += len(self.view)
+        if pos < 0:
+            raise ValueError("negative seek position")
+        self.pos = pos
+        return pos
+
+    def tell(self) -> int:
+        return self.pos
+
+    def flush(self):
+        pass
+
+    def write(self, data):
+        raise io.UnsupportedOperation("write")
+
+    def truncate(self, size=None):
+        raise io.UnsupportedOperation("truncate")
+
+    def close(self):
+        self.view.release()
+        for obj in self.owned:
+            # The mapping stays alive while views of it are still used
+            try:
+                obj.close()
+            except BufferError:
+                pass
+
+
+class PatchJournal(object):
+    # Writes recorded as (offset, bytes) and applied in one pass, adjacent and
+    # overlapping ones are merged first and the last write of a byte wins
+    def __init__(self, check_conflicts=False):
+        self.check_conflicts = check_conflicts
+        self.patches: list[tuple[int, bytes]] = []
+        # (offset, size) of the writes changing bytes already written
+        self.conflicts: list[tuple[int, int]] = []
+        self.stats = {"writes": 0, "bytes": 0, "ranges": 0, "merged": 0, "bytes_written": 0}
+
+    def add(self, pos, data):
+        self.patches.append((pos, bytes(data)))
+
+    def merge(self) -> list[tuple[int, bytearray]]:
+        order = sorted(range(len(self.patches)), key=lambda i: self.patches[i][0])
+
+        # Groups of writes touching each other, in recorded order
+        groups: list[tuple[int, int, list[int]]] = []
+        for i in order:
+            pos, data = self.patches[i]
+            if groups and pos <= groups[-1][1]:
+                start, end, members = groups[-1]
+                groups[-1] = (start, max(end, pos + len(data)), members)
+                members.append(i)
+            else:
+                groups.append((pos, pos + len(data), [i]))
+
+        ranges = []
+        for start, end, members in groups:
+            buffer = bytearray(end - start)
+            written = bytearray(end - start) if self.check_conflicts else None
+            for i in sorted(members):
+                pos, data = self.patches[i]
+                lo, hi = pos - start, pos - start + len(data)
+                if written is not None:
+                    if written.find(1, lo, hi) != -1 and any(
+                            w and old != new for w, old, new in zip(written[lo:hi], buffer[lo:hi], data)):
+                        self.conflicts.append((pos, len(data)))
+                    written[lo:hi] = b"\x01" * len(data)
+                buffer[lo:hi] = data
+            ranges.append((start, buffer))
+
+        self.stats["writes"] += len(self.patches)
+        self.stats["bytes"] += sum(len(data) for _, data in self.patches)
+        self.stats["ranges"] += len(ranges)
+        self.stats["merged"] += len(self.patches) - len(ranges)
+        self.stats["bytes_written"] += sum(len(buffer) for _, buffer in ranges)
+        self.patches = []
+        return ranges
 
 
 class FileIO(object):
-    def __init__(self, path: Union[Path, str, BytesIO, bytes], mode="r+b", endian="little"):
+    def __init__(self, path: Union[Path, str, BytesIO, bytes, bytearray, memoryview], mode="r+b", endian="little",
+                 use_mmap: Optional[bool] = None):
         self.mode: str = mode
         self._isBitesIO = False
-        if type(path) is bytes:
+        # None lets big files opened read only be mapped
+        self.use_mmap = use_mmap
+        if isinstance(path, (bytes, bytearray, memoryview)):
             self.path = None
-            self.f = path # type: ignore
+            self._f = path # type: ignore
             self.is_memory_file = True
         elif type(path) is BytesIO:
             self.path = None
-            self.f = path
+            self._f = path
             self._isBitesIO = True
             self.is_memory_file = True
         else:
             self.path = path
             self.is_memory_file = False
         self.endian = "<" if endian == "little" or endian == "<" else ">"
+        # Descriptor for the positional reads and writes of the _at methods
+        self._fd: Optional[int] = None
+        self._buffered = False
+        self.journal: Optional[PatchJournal] = None
+
+    @property
+    def f(self):
+        # Used directly, the buffered file can be out of sync with the disk
+        self._buffered = True
+        return self._f
+
+    @f.setter
+    def f(self, value):
+        self._f = value
+        self._buffered = True
 
     def __enter__(self):
+        read_only = self.mode == "rb"
         if self.is_memory_file:
-            self.f: io.BufferedIOBase = self.f if self._isBitesIO else BytesIO(self.f) # type: ignore
+            if self._isBitesIO:
+                pass
+            elif read_only:
+                # memoryview mode, nothing is copied
+                self._f = MemoryReader(self._f)
+            else:
+                self._f: io.BufferedIOBase = BytesIO(self._f) # type: ignore
         else:
-            self.f:io.BufferedIOBase = open(self.path, self.mode) # type: ignore
-        self.f.seek(0)
+            self._f:io.BufferedIOBase = open(self.path, self.mode) # type: ignore
+            if read_only and self.use_mmap is not False:
+                size = os.fstat(self._f.fileno()).st_size
+                if size > 0 and (self.use_mmap or size >= MMAP_THRESHOLD):
+                    mapped = mmap.mmap(self._f.fileno(), 0, access=mmap.ACCESS_READ)
+                    self._f = MemoryReader(mapped, owned=(mapped, self._f))
+
+            # Not in append mode, the writes always go at the end there
+            if not self.is_view_mode() and hasattr(os, "pread") and "a" not in self.mode:
+                self._fd = self._f.fileno()
+        self._f.seek(0)
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
-        self.f.close()
+        if exc_type is None:
+            self.apply_journal()
+        self._f.close()
 
     def close(self):
-        self.f.close()
+        self.apply_journal()
+        self._f.close()
+
+    def flush(self):
+        self.apply_journal()
+        self._f.flush()
+
+    def start_journal(self, check_conflicts=False) -> PatchJournal:
+        # The _at writes are recorded until flush, stop_journal or the end
+        # of the with block, reads don't see them before that
+        self.apply_journal()
+        self.journal = PatchJournal(check_conflicts)
+        return self.journal
+
+    def stop_journal(self) -> PatchJournal:
+        journal = self.journal
+        self.apply_journal()
+        self.journal = None
+        return journal
+
+    def apply_journal(self):
+        if self.journal is None or not self.journal.patches:
+            return
+        journal = self.journal
+        self.journal = None
+        try:
+            for pos, data in journal.merge():
+                self.write_at(pos, data)
+        finally:
+            self.journal = journal
 
     def tell(self):
-        return self.f.tell()
+        return self._f.tell()
     
     def truncate(self, size=None):
+        self._buffered = True
         if size is None:
-            self.f.truncate(self.f.tell())
+            self._f.truncate(self._f.tell())
         else:
-            self.f.truncate(size)
+            self._f.truncate(size)
 
     def seek(self, pos, whence=0):
-        self.f.seek(pos, whence)
+        self._buffered = True
+        self._f.seek(pos, whence)
 
     def read(self, n=-1):
-        return self.f.read(n)
+        self._buffered = True
+        return self._f.read(n)
+
+    def _sync(self):
+        # Buffered writes reach the file before the positional I/O, the read
+        # buffer is dropped at the same time so it can't be stale afterwards
+        if self._buffered:
+            self._f.flush()
+            self._buffered = False
+
+    def is_view_mode(self) -> bool:
+        # mmap or memoryview mode
+        return isinstance(self._f, MemoryReader)
+
+    def read_view(self, n=-1) -> memoryview:
+        if self.is_view_mode():
+            return self._f.read_view(n)
+        return memoryview(self.read(n))
 
     def read_at(self, pos, n=-1):
+        # A view in mmap and memoryview modes, the
+        # current position is never used or moved
+        if self.is_view_mode():
+            return self._f.view_at(pos, n)
+        if self._fd is not None and n >= 0:
+            self._sync()
+            return os.pread(self._fd, n, pos)
+        if isinstance(self._f, BytesIO):
+            with self._f.getbuffer() as buffer:
+                return bytes(buffer[pos:] if n < 0 else buffer[pos:pos + n])
+
         current = self.tell()
         self.seek(pos)
         ret = self.read(n)
@@ -60,9 +282,27 @@ class FileIO(object):
         return ret
 
     def write(self, data):
-        self.f.write(data)
+        self._buffered = True
+        self._f.write(data)
 
     def write_at(self, pos, data):
+        if self.journal is not None:
+            self.journal.add(pos, data)
+            return
+        if self._fd is not None:
+            self._sync()
+            view = memoryview(data)
+            while len(view) > 0:
+                n = os.pwrite(self._fd, view, pos)
+                view = view[n:]
+                pos += n
+            return
+        if isinstance(self._f, BytesIO):
+            with self._f.getbuffer() as buffer:
+                if pos + len(data) <= len(buffer):
+                    buffer[pos:pos + len(data)] = data
+                    return
+
         current = self.tell()
         self.seek(pos)
         self.write(data)
@@ -75,204 +315,218 @@ class FileIO(object):
         return ret
 
     def write_line(self, data):
-        self.f.write(data + "\n")
+        self.write(data + "\n")
 
     def set_endian(self, endian):
         self.endian = "<" if endian == "little" or endian == "<" else ">"
 
-    def read_int8(self):
-        return struct.unpack("b", self.read(1))[0]
+    def get_struct(self, fmt: str) -> struct.Struct:
+        cache = STRUCTS[self.endian]
+        ret = cache.get(fmt)
+        if ret is None:
+            ret = cache[fmt] = struct.Struct(self.endian + fmt)
+        return ret
+
+    def read_struct(self, fmt: Union[str, struct.Struct]) -> tuple:
+        # A Struct keeps its own endian, a format uses the one of the file
+        s = fmt if isinstance(fmt, struct.Struct) else self.get_struct(fmt)
+        return s.unpack(self.read(s.size))
+
+    def read_struct_at(self, pos, fmt: Union[str, struct.Struct]) -> tuple:
+        return self.unpack_at(pos, fmt)
+
+    def unpack_at(self, pos, fmt: Union[str, struct.Struct]) -> tuple:
+        s = fmt if isinstance(fmt, struct.Struct) else self.get_struct(fmt)
+        if self._fd is not None:
+            self._sync()
+            return s.unpack(os.pread(self._fd, s.size, pos))
+        if self.is_view_mode():
+            return s.unpack_from(self._f.view, pos)
+        if isinstance(self._f, BytesIO):
+            with self._f.getbuffer() as buffer:
+                return s.unpack_from(buffer, pos)
 
-    def read_int8_at(self, pos):
         current = self.tell()
         self.seek(pos)
-        ret = self.read_int8()
+        ret = s.unpack(self.read(s.size))
         self.seek(current)
         return ret
 
+    def pack_at(self, pos, fmt: Union[str, struct.Struct], *values):
+        s = fmt if isinstance(fmt, struct.Struct) else self.get_struct(fmt)
+        if self.journal is None and isinstance(self._f, BytesIO):
+            with self._f.getbuffer() as buffer:
+                if pos + s.size <= len(buffer):
+                    s.pack_into(buffer, pos, *values)
+                    return
+        self.write_at(pos, s.pack(*values))
+
+    def read_array(self, fmt: str, count: int, numpy=False):
+        # count values of a single format character read at once, as an
+        # array.array in the native endian or a read only NumPy view
+        typecode = ARRAY_TYPES[fmt]
+        return self._to_array(self.read(array.array(typecode).itemsize * count), typecode, count, numpy)
+
+    def read_array_at(self, pos, fmt: str, count: int, numpy=False):
+        typecode = ARRAY_TYPES[fmt]
+        return self._to_array(self.read_at(pos, array.array(typecode).itemsize * count), typecode, count, numpy)
+
+    def _to_array(self, data, typecode: str, count: int, numpy: bool):
+        size = array.array(typecode).itemsize * count
+        if len(data) != size:
+            raise struct.error(f"read_array requires a buffer of {size} bytes")
+
+        if numpy:
+            import numpy as np
+            return np.frombuffer(data, dtype=np.dtype(self.endian + typecode))
+
+        ret = array.array(typecode)
+        ret.frombytes(data)
+        if self.endian != NATIVE_ENDIAN:
+            ret.byteswap()
+        return ret
+
+    def write_array(self, fmt: str, values):
+        self.write(self._array_bytes(fmt, values))
+
+    def write_array_at(self, pos, fmt: str, values):
+        self.write_at(pos, self._array_bytes(fmt, values))
+
+    def _array_bytes(self, fmt: str, values) -> bytes:
+        typecode = ARRAY_TYPES[fmt]
+        if type(values).__module__ == "numpy":
+            return values.astype(self.endian + typecode, copy=False).tobytes()
+
+        # Copied when swapped so the values of the caller are kept
+        if not isinstance(values, array.array) or values.typecode != typecode or self.endian != NATIVE_ENDIAN:
+            values = array.array(typecode, values)
+        if self.endian != NATIVE_ENDIAN:
+            values.byteswap()
+        return values.tobytes()
+
+    def read_int8(self):
+        return struct.unpack("b", self.read(1))[0]
+
+    def read_int8_at(self, pos):
+        return self.unpack_at(pos, "b")[0]
+
     def read_uint8(self):
         return struct.unpack("B", self.read(1))[0]
 
     def read_uint8_at(self, pos):
-        current = self.tell()
-        self.seek(pos)
-        ret = self.read_uint8()
-        self.seek(current)
-        return ret
+        return self.unpack_at(pos, "B")[0]
 
     def read_int16(self):
         return struct.unpack(self.endian + "h", self.read(2))[0]
 
     def read_int16_at(self, pos):
-        current = self.tell()
-        self.seek(pos)
-        ret = self.read_int16()
-        self.seek(current)
-        return ret
+        return self.unpack_at(pos, "h")[0]
 
     def read_uint16(self):
         return struct.unpack(self.endian + "H", self.read(2))[0]
 
     def read_uint16_at(self, pos):
-        current = self.tell()
-        self.seek(pos)
-        ret = self.read_uint16()
-        self.seek(current)
-        return ret
+        return self.unpack_at(pos, "H")[0]
 
     def read_int32(self):
         return struct.unpack(self.endian + "i", self.read(4))[0]
 
     def read_int32_at(self, pos):
-        current = self.tell()
-        self.seek(pos)
-        ret = self.read_int32()
-        self.seek(current)
-        return ret
+        return self.unpack_at(pos, "i")[0]
 
     def read_uint32(self):
         return struct.unpack(self.endian + "I", self.read(4))[0]
 
     def read_uint32_at(self, pos):
-        current = self.tell()
-        self.seek(pos)
-        ret = self.read_uint32()
-        self.seek(current)
-        return ret
+        return self.unpack_at(pos, "I")[0]
 
     def read_int64(self):
         return struct.unpack(self.endian + "q", self.read(8))[0]
 
     def read_int64_at(self, pos):
-        current = self.tell()
-        self.seek(pos)
-        ret = self.read_int64()
-        self.seek(current)
-        return ret
+        return self.unpack_at(pos, "q")[0]
 
     def read_uint64(self):
         return struct.unpack(self.endian + "Q", self.read(8))[0]
 
     def read_uint64_at(self, pos):
-        current = self.tell()
-        self.seek(pos)
-        ret = self.read_uint64()
-        self.seek(current)
-        return ret
+        return self.unpack_at(pos, "Q")[0]
 
     def read_single(self):
         return struct.unpack(self.endian + "f", self.read(4))[0]
 
     def read_single_at(self, pos):
-        current = self.tell()
-        self.seek(pos)
-        ret = self.read_single()
-        self.seek(current)
-        return ret
+        return self.unpack_at(pos, "f")[0]
 
     def read_double(self):
         return struct.unpack(self.endian + "d", self.read(8))[0]
 
     def read_double_at(self, pos):
-        current = self.tell()
-        self.seek(pos)
-        ret = self.read_double()
-        self.seek(current)
-        return ret
+        return self.unpack_at(pos, "d")[0]
     
     def skip_padding(self, alignment):
         while self.tell() % alignment != 0:
             self.read_uint8()
 
     def write_int8(self, num):
-        self.f.write(struct.pack("b", num))
+        self.write(struct.pack("b", num))
 
     def write_int8_at(self, pos, num):
-        current = self.tell()
-        self.seek(pos)
-        self.write_int8(num)
-        self.seek(current)
+        self.pack_at(pos, "b", num)
 
     def write_uint8(self, num):
-        self.f.write(struct.pack("B", num))
+        self.write(struct.pack("B", num))
 
     def write_uint8_at(self, pos, num):
-        current = self.tell()
-        self.seek(pos)
-        self.write_uint8(num)
-        self.seek(current)
+        self.pack_at(pos, "B", num)
 
     def write_int16(self, num):
-        self.f.write(struct.pack(self.endian + "h", num))
+        self.write(struct.pack(self.endian + "h", num))
 
     def write_int16_at(self, pos, num):
-        current = self.tell()
-        self.seek(pos)
-        self.write_int16(num)
-        self.seek(current)
+        self.pack_at(pos, "h", num)
 
     def write_uint16(self, num):
-        self.f.write(struct.pack(self.endian + "H", num))
+        self.write(struct.pack(self.endian + "H", num))
 
     def write_uint16_at(self, pos, num):
-        current = self.tell()
-        self.seek(pos)
-        self.write_uint16(num)
-        self.seek(current)
+        self.pack_at(pos, "H", num)
 
     def write_int32(self, num):
-        self.f.write(struct.pack(self.endian + "i", num))
+        self.write(struct.pack(self.endian + "i", num))
 
     def write_int32_at(self, pos, num):
-        current = self.tell()
-        self.seek(pos)
-        self.write_int32(num)
-        self.seek(current)
+        self.pack_at(pos, "i", num)
 
     def write_uint32(self, num):
-        self.f.write(struct.pack(self.endian + "I", num))
+        self.write(struct.pack(self.endian + "I", num))
 
     def write_uint32_at(self, pos, num):
-        current = self.tell()
-        self.seek(pos)
-        self.write_uint32(num)
-        self.seek(current)
+        self.pack_at(pos, "I", num)
 
     def write_int64(self, num):
-        self.f.write(struct.pack(self.endian + "q", num))
+        self.write(struct.pack(self.endian + "q", num))
 
     def write_int64_at(self, pos, num):
-        current = self.tell()
-        self.seek(pos)
-        self.write_int64(num)
-        self.seek(current)
+        self.pack_at(pos, "q", num)
 
     def write_uint64(self, num):
-        self.f.write(struct.pack(self.endian + "Q", num))
+        self.write(struct.pack(self.endian + "Q", num))
 
     def write_uint64_at(self, pos, num):
-        current = self.tell()
-        self.seek(pos)
-        self.write_uint64(num)
-        self.seek(current)
+        self.pack_at(pos, "Q", num)
 
     def write_single(self, num):
-        self.f.write(struct.pack(self.endian + "f", num))
+        self.write(struct.pack(self.endian + "f", num))
 
     def write_single_at(self, pos, num):
-        current = self.tell()
-        self.seek(pos)
-        self.write_single(num)
-        self.seek(current)
+        self.pack_at(pos, "f", num)
 
     def write_double(self, num):
-        self.f.write(struct.pack(self.endian + "d", num))
+        self.write(struct.pack(self.endian + "d", num))
 
     def write_double_at(self, pos, num):
-        current = self.tell()
-        self.seek(pos)
-        self.write_double(num)
-        self.seek(current)
+        self.pack_at(pos, "d", num)
 
     def write_padding(self, alignment, pad_byte=0x00):
         while self.tell() % alignment != 0:
@@ -1,12 +1,13 @@
-import shutil
 from dataclasses import dataclass
 import struct
 from typing import Optional
 from ..formats.FileIO import FileIO
 from ..formats.tss import Tss
+from ..utils import nds_lz
+from ..utils.parallel import map_jobs
+import mmap
 import os
 from pathlib import Path
-import subprocess
 
 
 @dataclass
@@ -23,9 +24,17 @@ dict_buffer = {
     0x28:32
 }
 
+def get_compression_type(data) -> str:
+    c_type = 'None'
+    if data[0] == 0x10:
+        c_type = 'LZ10'
+    elif data[0] == 0x11:
+        c_type = 'LZ11'
+    return c_type
+
 class Fps4():
 
-    def __init__(self, header_path:Path , detail_path:Path = None, size_adjusted = 0) -> None:
+    def __init__(self, header_path:Path , detail_path:Path = None, size_adjusted = 0, lazy = False) -> None:
         self.type = -1
         self.align = False
         self.files = []
@@ -34,19 +43,32 @@ class Fps4():
         self.detail_path = detail_path or header_path
         self.size_adjusted = size_adjusted
 
+        #Index only, the files data are memoryview slices of the mmaped detail file
+        self.lazy = lazy
+        self.detail_map = None
+        self.detail_view = None
+
         self.extract_information()
+        self.files_by_name = {file.name: file for file in self.files}
 
     def extract_information(self):
         with FileIO(self.header_path) as f_header:
-            self.header_data = f_header.read()
             f_header.seek(4,0)
             self.file_amount = f_header.read_uint32()-1
             self.header_size = f_header.read_uint32()
             self.offset = f_header.read_uint32()
             self.block_size = f_header.read_uint16()
 
-            self.files = []
+            #Type 2 has the files after the header, only keep the table
+            f_header.seek(0,0)
+            if self.lazy and self.offset != 0x0:
+                self.header_data = f_header.read(self.header_size + 4 * self.file_amount)
+            else:
+                self.header_data = f_header.read()
 
+            self.files = []
+            if self.lazy:
+                self.open_detail()
 
             if self.offset == 0x0:
                 self.pack_file = self.pack_fps4_type1
@@ -62,6 +84,26 @@ class Fps4():
             else:
                 self.pack_file = self.pack_fps4_type1
                 self.extract_type2_fps4(f_header=f_header)
+
+    def open_detail(self):
+        with open(self.detail_path, 'rb') as f:
+            self.detail_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.detail_view = memoryview(self.detail_map)
+
+    def close(self):
+        #The slices need to be released before the mmap can be closed
+        if self.detail_map is not None:
+            for file in self.files:
+                if isinstance(file.data, memoryview):
+                    file.data.release()
+            self.detail_view.release()
+            self.detail_map.close()
+            self.detail_map = None
+            self.detail_view = None
+
+    def get_file(self, name:str) -> fps4_file:
+        return self.files_by_name[name]
+
     #Type 2 = Header with File offset
     def extract_type2_fps4(self, f_header:FileIO):
 
@@ -74,17 +116,14 @@ class Fps4():
 
         #Create each file
         for i in range(len(files_offset)-1):
-            f_header.seek(files_offset[i], 0)
             size = files_offset[i+1] - files_offset[i]
-            data = f_header.read(size)
-            c_type = 'None'
-
-            if data[0] == 0x10:
-                c_type = 'LZ10'
-            elif data[0] == 0x11:
-                c_type = 'LZ11'
+            if self.lazy:
+                data = self.detail_view[files_offset[i]:files_offset[i+1]]
+            else:
+                f_header.seek(files_offset[i], 0)
+                data = f_header.read(size)
 
-            self.files.append(fps4_file(c_type, data, f'{i}.bin', size, i, files_offset[i]))
+            self.files.append(fps4_file(get_compression_type(data), data, f'{i}.bin', size, i, files_offset[i]))
 
 
     #Type 1 = Header + Detail
@@ -93,16 +132,19 @@ class Fps4():
         files_infos = []
         f_header.seek(self.header_size, 0)
 
-        with FileIO(self.detail_path) as det:
-            for _ in range(self.file_amount):
-                offset = f_header.read_uint32()
-                size = f_header.read_uint32()
+        # Offset, size, (unknown) and name of each file
+        entry = f_header.get_struct("II4x32s" if self.read_more else "II32s")
+        for _ in range(self.file_amount):
+            offset, size, name = f_header.read_struct(entry)
+            files_infos.append((offset, size, name.decode("ASCII").strip('\x00')))
 
-                if self.read_more:
-                    f_header.read_uint32()
-                name = f_header.read(32).decode("ASCII").strip('\x00')
-                files_infos.append((offset, size, name))
+        if self.lazy:
+            for i, (offset, size, name) in enumerate(files_infos):
+                data = self.detail_view[offset:offset + size]
+                self.files.append(fps4_file(get_compression_type(data), data, name, size, i, offset))
+            return
 
+        with FileIO(self.detail_path, "rb") as det:
             i=0
             for offset, size, name in files_infos:
                 #print(f'name: {name} - size: {size}')
@@ -110,49 +152,54 @@ class Fps4():
                 det.seek(offset)
                 data = det.read(size)
 
-                c_type = 'None'
-                if data[0] == 0x10:
-                    c_type = 'LZ10'
-                elif data[0] == 0x11:
-                    c_type = 'LZ11'
-
-                self.files.append(fps4_file(c_type, data, name, size, i, offset))
+                self.files.append(fps4_file(get_compression_type(data), data, name, size, i, offset))
                 i+=1
 
-    def extract_files(self, destination_path:Path, copy_path:Path, decompressed=False):
+    def extract_files(self, destination_path:Path, copy_path:Path, decompressed=False, jobs:int = 1):
 
         destination_path.mkdir(parents=True, exist_ok=True)
-        for file in self.files:
+        copy_path.mkdir(parents=True, exist_ok=True)
 
-            copy_path.mkdir(parents=True, exist_ok=True)
-            with open(destination_path / file.name, "wb") as f:
-                f.write(file.data)
+        #Decompress LZ10 in memory, LZ11 files are kept as is like lzss -d did
+        to_decompress = [file for file in self.files if decompressed and file.c_type == 'LZ10']
+        decompressed_data = dict(zip([file.rank for file in to_decompress],
+                                     map_jobs(nds_lz.decompress, [bytes(file.data) for file in to_decompress], jobs=jobs)))
 
-            shutil.copy(destination_path / file.name, copy_path / file.name)
+        for file in self.files:
 
-            #Decompress using LZ10 or LZ11
-            if decompressed:
-                args = ['lzss', '-d', destination_path / file.name]
-                subprocess.run(args, cwd=Path.cwd() / 'pythonlib/utils', stdout = subprocess.DEVNULL)
+            #Keep the original file for the repacking
+            with open(copy_path / file.name, "wb") as f:
+                f.write(file.data)
 
-            with open(destination_path / file.name, 'rb') as f:
-                head = f.read(4)
+            data = decompressed_data.get(file.rank, file.data)
+            with open(destination_path / file.name, "wb") as f:
+                f.write(data)
 
-                if head == b'FPS4':
-                    file.file_extension = 'FPS4'
-                elif head[:-1] == b'TSS':
-                    file.file_extension = 'TSS'
+            if data[:4] == b'FPS4':
+                file.file_extension = 'FPS4'
+            elif data[:3] == b'TSS':
+                file.file_extension = 'TSS'
 
     def compress_file(self, updated_file_path:Path, file_name:str, c_type:str):
-        args = []
-        if c_type == 'LZ10':
-            args = ['lzss', '-evn', updated_file_path / file_name]
-        elif c_type == "LZ11":
-            args = ['lzx', '-evb', updated_file_path / file_name]
-        subprocess.run(args, cwd=Path.cwd() / 'pythonlib/utils', stdout = subprocess.DEVNULL)
-
-    def pack_fps4_type1(self, updated_file_path:Path, destination_folder:Path):
+        file_path = updated_file_path / file_name
+        file_path.write_bytes(nds_lz.compress(file_path.read_bytes(), c_type))
+
+    def compress_files(self, updated_file_path:Path, updated_files:dict[str, bytes], jobs:int = 1) -> dict[str, bytes]:
+        #Compress the updated members with their original compression
+        #and keep the result in the updated folder for the next runs
+        files = [file for file in self.files if file.name in updated_files]
+        compressed = map_jobs(nds_lz.compress, [updated_files[file.name] for file in files],
+                              [file.c_type for file in files], jobs=jobs)
+
+        compressed_files = {}
+        for file, data in zip(files, compressed):
+            (updated_file_path / file.name).write_bytes(data)
+            compressed_files[file.name] = data
+        return compressed_files
+
+    def pack_fps4_type1(self, updated_file_path:Path, destination_folder:Path, updated_files:dict[str, bytes] = None, jobs:int = 1):
         buffer = 0
+        compressed_files = self.compress_files(updated_file_path, updated_files or {}, jobs)
 
         #Update detail file
         self.files.sort(key= lambda file: file.offset)
@@ -160,14 +207,16 @@ class Fps4():
 
             #Writing new dat file and updating file attributes
             for file in self.files:
-                #self.compress_file(updated_file_path, file_name=file.name, c_type=file.c)
-
-                with FileIO(updated_file_path / file.name, 'rb') as sub_file:
-                    file.data = sub_file.read()
-                    file.offset = buffer
-                    file.size = len(file.data)
-                    buffer += file.size
-                    fps4_detail.write(file.data)
+                if file.name in compressed_files:
+                    file.data = compressed_files[file.name]
+                else:
+                    with FileIO(updated_file_path / file.name, 'rb') as sub_file:
+                        file.data = sub_file.read()
+
+                file.offset = buffer
+                file.size = len(file.data)
+                buffer += file.size
+                fps4_detail.write(file.data)
 
         #Update header file
         with FileIO(self.header_data, "r+b") as fps4_header:
@@ -2,7 +2,7 @@ from dataclasses import dataclass
 import struct
 from typing import Optional
 from ..formats.FileIO import FileIO
-from ..utils import comptolib
+from ..utils import comptolib, compto_cache
 
 
 @dataclass
@@ -34,25 +34,23 @@ class Pak():
 
             # Pak0
             if type == 0:
-                for _ in range(file_amount):
-                    sizes.append(f.read_uint32())
+                sizes = f.read_array("I", file_amount).tolist()
                 
                 for size in sizes:
                     blobs.append(f.read(size))
 
             # Pak1
             elif type == 1:
-                for _ in range(file_amount):
-                    offsets.append(f.read_uint32())
-                    sizes.append(f.read_uint32())
+                pairs = f.read_array("I", 2 * file_amount)
+                offsets = pairs[0::2].tolist()
+                sizes = pairs[1::2].tolist()
 
                 for offset, size in zip(offsets, sizes):
                     f.seek(offset)
                     blobs.append(f.read(size))
             # Pak3
             elif type == 3:
-                for _ in range(file_amount):
-                    offsets.append(f.read_uint32())
+                offsets = f.read_array("I", file_amount).tolist()
                 f.seek(0, 2)
                 offsets.append(f.tell())
                 for i, j in zip(offsets[::1], offsets[1::1]):
@@ -132,60 +130,89 @@ class Pak():
         return None
     
 
-    def to_bytes(self, type=-1) -> bytes:
-        
-        compose_mode = type if type != -1 else self.type
-        if compose_mode == -1:
-            raise ValueError("Trying to compose an invalid PAK type")
-        
-        # Collect blobs
+    def get_blobs(self) -> list[bytes]:
         blobs = []
         for blob in self.files:
             if blob.is_compressed:
-                blobs.append(comptolib.compress_data(blob.data, version=blob.type))
+                blobs.append(compto_cache.compress_data(blob.data, version=blob.type))
             else:
                 blobs.append(blob.data)
+        return blobs
 
-        # Compose
-        out = struct.pack("<I", len(self.files))
-        
-        # Pak0
+
+    def get_layout(self, sizes: list[int], compose_mode: int) -> tuple[list[int], int]:
+        # Offset of every file and total size, the header is
+        # the file amount and a table depending on the type
         if compose_mode == 0:
-            for blob in blobs:
-                out += struct.pack("<I", len(blob))
-        # Pak1
+            pos = 4 + (4 * len(sizes))
         elif compose_mode == 1:
-            offset = 4 + (8 * len(blobs))
-            sizes = [0] + list([len(x) for x in blobs])
-            if self.align:
-                offset = offset + (0x10 - (offset % 0x10))
-
-            for i, j in zip(sizes[::1], sizes[1::1]):
-                if self.align:
-                    i = i + (0x10 - (i % 0x10))
-                struct.pack("<I", offset + i)
-                struct.pack("<I", j)
-                offset += i
-        # Pak3
+            pos = 4 + (8 * len(sizes))
         elif compose_mode == 3:
-            offset = 4 + (4 * len(blobs))
+            pos = 4 + (4 * len(sizes))
+        else:
+            raise ValueError("Trying to compose an invalid PAK type")
+
+        offsets = []
+        for size in sizes:
             if self.align:
-                offset = offset + (0x10 - (offset % 0x10))
+                pos += 0x10 - (pos % 0x10)
+            offsets.append(pos)
+            pos += size
+        return offsets, pos
 
-            cur = offset
-            for blob in blobs:
-                out += struct.pack("<I", cur)
-                cur += len(blob)
-                if self.align:
-                    cur += (0x10 - (cur % 0x10))
 
-        # add files
-        for blob in blobs:
-            if self.align:
-                out += b"\x00" * (0x10 - (len(out) % 0x10))
-            out += blob
+    def get_header(self, sizes: list[int], offsets: list[int], compose_mode: int) -> bytearray:
+        if compose_mode == 0:
+            table = sizes
+        elif compose_mode == 1:
+            table = [value for pair in zip(offsets, sizes) for value in pair]
+        else:
+            table = offsets
+
+        header = bytearray(4 + (4 * len(table)))
+        struct.pack_into(f"<I{len(table)}I", header, 0, len(sizes), *table)
+        return header
+
+
+    def to_bytes(self, type=-1) -> bytes:
+        
+        compose_mode = type if type != -1 else self.type
+        if compose_mode == -1:
+            raise ValueError("Trying to compose an invalid PAK type")
+        
+        blobs = self.get_blobs()
+        sizes = [len(blob) for blob in blobs]
+        offsets, total = self.get_layout(sizes, compose_mode)
+
+        # Everything is placed in one buffer, the padding is already zeros
+        out = bytearray(total)
+        header = self.get_header(sizes, offsets, compose_mode)
+        out[:len(header)] = header
+        for offset, blob in zip(offsets, blobs):
+            out[offset:offset + len(blob)] = blob
+
+        return bytes(out)
+
+
+    def write_to(self, f, type=-1) -> int:
+        # Same as to_bytes but written directly to a file object
+        compose_mode = type if type != -1 else self.type
+        if compose_mode == -1:
+            raise ValueError("Trying to compose an invalid PAK type")
+
+        blobs = self.get_blobs()
+        sizes = [len(blob) for blob in blobs]
+        offsets, total = self.get_layout(sizes, compose_mode)
+
+        header = self.get_header(sizes, offsets, compose_mode)
+        f.write(header)
+        pos = len(header)
+        for offset, blob in zip(offsets, blobs):
+            f.write(bytes(offset - pos))
+            f.write(blob)
+            pos = offset + len(blob)
 
-        return out
+        return total
     
 
     def __getitem__(self, item):
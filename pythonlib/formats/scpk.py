@@ -3,7 +3,7 @@ from dataclasses import dataclass
 from pathlib import Path
 
 from ..formats.FileIO import FileIO
-from ..utils import comptolib
+from ..utils import comptolib, compto_cache
 
 MAGIC = b"SCPK"
 
@@ -58,29 +58,46 @@ class Scpk():
         return self
     
 
-    def to_bytes(self):
-        out = MAGIC
-        out += struct.pack("<H", self.unk1)
-        out += struct.pack("<H", self.unk2)
-        out += struct.pack("<I", len(self.files))
-        out += struct.pack("<I", 0)
-
+    def get_blobs(self) -> list[bytes]:
         blobs = []
         for blob in self.files:
             if blob.is_compressed:
-                blobs.append(comptolib.compress_data(blob.data, version=blob.type))
+                blobs.append(compto_cache.compress_data(blob.data, version=blob.type))
             else:
                 blobs.append(blob.data)
-        
-        # add sizes
-        for l in [len(x) for x in blobs]:
-            out += struct.pack("<I", l)
+        return blobs
+
+
+    def get_header(self, sizes: list[int]) -> bytearray:
+        header = bytearray(0x10 + (4 * len(sizes)))
+        struct.pack_into(f"<4sHHII{len(sizes)}I", header, 0, MAGIC, self.unk1, self.unk2, len(sizes), 0, *sizes)
+        return header
+
+
+    def to_bytes(self):
+        blobs = self.get_blobs()
+        header = self.get_header([len(blob) for blob in blobs])
+
+        # The files follow the header without padding
+        out = bytearray(len(header) + sum(len(blob) for blob in blobs))
+        out[:len(header)] = header
+        pos = len(header)
+        for blob in blobs:
+            out[pos:pos + len(blob)] = blob
+            pos += len(blob)
+
+        return bytes(out)
+
 
-        # add files
+    def write_to(self, f) -> int:
+        # Same as to_bytes but written directly to a file object
+        blobs = self.get_blobs()
+        header = self.get_header([len(blob) for blob in blobs])
+        f.write(header)
         for blob in blobs:
-            out += blob
+            f.write(blob)
 
-        return out
+        return len(header) + sum(len(blob) for blob in blobs)
     
 
     @property
@@ -142,17 +142,19 @@ class StructNode:
             entry.bubble_list = self.extract_bubbles(jap_text, bytes)
             self.texts_entry.append(entry)
 
-    def parse_xml_nodes(self, xml_nodes_list, list_status_insertion):
-        self.id = int(xml_nodes_list[0].find("Id").text)
+    def parse_xml_nodes(self, xml_nodes: dict, list_status_insertion):
+        # xml_nodes is indexed by (SubId, BubbleId), see Tss.index_xml_entries
+        self.id = int(next(iter(xml_nodes.values())).find("Id").text)
 
-        max_sub_id = max([int(entry.find("SubId").text) for entry in xml_nodes_list])
+        max_bubble_ids = {}
+        for sub_id, bubble_id in xml_nodes.keys():
+            max_bubble_ids[sub_id] = max(bubble_id, max_bubble_ids.get(sub_id, 0))
 
-        for sub_id in range(1, max_sub_id + 1):
+        for sub_id in range(1, max(max_bubble_ids.keys()) + 1):
 
-            sub_nodes = [sub for sub in xml_nodes_list if int(sub.find('SubId').text) == sub_id]
-            max_bubble_id = max([int(entry.find('BubbleId').text) for entry in sub_nodes])
+            max_bubble_id = max_bubble_ids[sub_id]
             for bubble_id in range(1, max_bubble_id + 1):
-                bubble = [bubble for bubble in sub_nodes if int(bubble.find('BubbleId').text) == bubble_id][0]
+                bubble = xml_nodes[(sub_id, bubble_id)]
                 entry_bytes, japanese_text, final_text, status = self.get_node_bytes(bubble, list_status_insertion, pad=False)
 
                 self.texts_entry[sub_id-1].bubble_list[bubble_id-1].jap_text = japanese_text
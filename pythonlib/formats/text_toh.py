@@ -1,8 +1,13 @@
+import hashlib
+import pickle
 import re
 import struct
 import pyjson5 as json
 import string
-from pythonlib.formats.FileIO import FileIO
+from io import BytesIO
+from pathlib import Path
+from typing import Optional, Union
+from pythonlib.formats.FileIO import FileIO, MemoryReader
 
 VALID_VOICEID = [r'(VSM_\w+)', r'(VCT_\w+)', r'(S\d+)', r'(C\d+)']
 COMMON_TAG = r"(<[\w/]+:?\w+>)"
@@ -10,25 +15,369 @@ HEX_TAG = r"(\{[0-9A-F]{2}\})"
 PRINTABLE_CHARS = "".join(
             (string.digits, string.ascii_letters, string.punctuation, " ")
         )
-jsonTblTags = dict()
-with open('../Tales-of-Hearts-DS/Project/tbl_all.json') as f:
-    jsonraw = json.loads(f.read(), encoding="utf-8")
-    for k, v in jsonraw.items():
-        jsonTblTags[k] = {int(k2, 16): v2 for k2, v2 in v.items()}
-
-ijsonTblTags = dict()
-for k, v in jsonTblTags.items():
-    if k in ['TAGS', 'TBL']:
-        ijsonTblTags[k] = {v2: k2 for k2, v2 in v.items()}
+# Encoding table of the translation repository, next to this one
+DEFAULT_TABLE_PATH = Path(__file__).resolve().parents[3] / 'Tales-of-Hearts-DS' / 'Project' / 'tbl_all.json'
+CACHE_FOLDER = Path(__file__).resolve().parents[2] / '.cache' / 'tbl'
+CACHE_VERSION = 1
+
+
+def read_tables(path: Path) -> (dict, dict, dict):
+    """Load the forward and reverse tables of an encoding table,
+    going through the compiled cache when it is still valid."""
+    stat = path.stat()
+    cache_path = CACHE_FOLDER / (hashlib.sha1(str(path).encode('utf-8')).hexdigest() + '.pickle')
+
+    cache = None
+    if cache_path.exists():
+        try:
+            with open(cache_path, 'rb') as f:
+                cache = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+            cache = None
+
+    if cache is not None and cache.get('version') == CACHE_VERSION:
+        if cache['mtime'] == stat.st_mtime_ns and cache['size'] == stat.st_size:
+            return cache['jsonTblTags'], cache['ijsonTblTags'], cache['iTags']
+
+    # Only hash the source when the timestamp doesn't match anymore
+    raw = path.read_bytes()
+    digest = hashlib.sha1(raw).hexdigest()
+    if cache is not None and cache.get('version') == CACHE_VERSION and cache['sha1'] == digest:
+        tables = cache['jsonTblTags'], cache['ijsonTblTags'], cache['iTags']
     else:
-        ijsonTblTags[k] = {v2: hex(k2).replace('0x', '').upper() for k2, v2 in v.items()}
-iTags = {v2.upper(): k2 for k2, v2 in jsonTblTags['TAGS'].items()}
+        jsonraw = json.loads(raw.decode('utf-8'))
+        jsonTblTags = dict()
+        for k, v in jsonraw.items():
+            jsonTblTags[k] = {int(k2, 16): v2 for k2, v2 in v.items()}
+
+        ijsonTblTags = dict()
+        for k, v in jsonTblTags.items():
+            if k in ['TAGS', 'TBL']:
+                ijsonTblTags[k] = {v2: k2 for k2, v2 in v.items()}
+            else:
+                ijsonTblTags[k] = {v2: hex(k2).replace('0x', '').upper() for k2, v2 in v.items()}
+        iTags = {v2.upper(): k2 for k2, v2 in jsonTblTags['TAGS'].items()}
+        tables = jsonTblTags, ijsonTblTags, iTags
+
+    cache = {
+        'version': CACHE_VERSION,
+        'mtime': stat.st_mtime_ns,
+        'size': stat.st_size,
+        'sha1': digest,
+        'jsonTblTags': tables[0],
+        'ijsonTblTags': tables[1],
+        'iTags': tables[2],
+    }
+    try:
+        CACHE_FOLDER.mkdir(parents=True, exist_ok=True)
+        with open(cache_path, 'wb') as f:
+            pickle.dump(cache, f, protocol=pickle.HIGHEST_PROTOCOL)
+    except OSError:
+        pass
+
+    return tables
+
+
+# Kind of each lead byte for the table driven decoder
+OP_END = 0
+OP_CHAR = 1
+OP_DOUBLE = 2
+OP_BUTTON = 3
+OP_VOICE = 4
+OP_TAG = 5
+
+
+class TextDecoder:
+    """Decode TOH strings straight from a bytes/memoryview buffer.
+
+    Same output as bytes_to_text, but every lead byte is resolved through
+    256-entry tables built once from the TBL/TAGS/BUTTON/COLOR/NAME tables.
+    """
+
+    def __init__(self, tbl_tags: dict):
+        chars = tbl_tags['TBL']
+        tags = tbl_tags['TAGS']
+        buttons = tbl_tags.get('BUTTON', {})
+
+        self.ops = [OP_CHAR] * 256
+        self.texts = ["{%02X}" % b for b in range(256)]
+        self.buttons = [None] * 256
+        self.tag_names = [None] * 256
+        self.tag_params = [None] * 256
+
+        # Text for a single byte, in the same priority as bytes_to_text
+        for b in range(256):
+            if chr(b) in PRINTABLE_CHARS:
+                self.texts[b] = chr(b)
+            elif 0xA0 < b < 0xE0:
+                self.texts[b] = struct.pack("B", b).decode("cp932")
+        self.texts[0xA] = "\n"
+        self.texts[0xC] = "<Bubble>"
+
+        for b in (0x3, 0x4, 0xB):
+            self.ops[b] = OP_TAG
+            tag_name = tags.get(b)
+            self.tag_names[b] = tag_name
+            if tag_name is not None:
+                self.tag_params[b] = tbl_tags.get(tag_name.upper(), {})
+
+        for b in range(0x80, 0xA0):
+            self.ops[b] = OP_DOUBLE
+        for b in range(0xE0, 0xEB):
+            self.ops[b] = OP_DOUBLE
+
+        for k, v in buttons.items():
+            if k < 256:
+                self.buttons[k] = f"<{v}>"
+        self.ops[0x81] = OP_BUTTON
+        self.ops[0x9] = OP_VOICE
+        self.ops[0xA] = OP_CHAR
+        self.ops[0x0] = OP_END
+
+        # Two bytes characters, missing ones are written as hex
+        self.doubles = {}
+        for b in range(0x80, 0xA0):
+            self._add_doubles(b, chars)
+        for b in range(0xE0, 0xEB):
+            self._add_doubles(b, chars)
+
+    def _add_doubles(self, lead: int, chars: dict):
+        for v in range(256):
+            c = (lead << 8) | v
+            self.doubles[c] = chars.get(c, "{%02X}{%02X}" % (lead, v))
+
+    def decode(self, data, offset: int = 0) -> (str, bytes, int):
+        """Decode the string at offset, returns the text, its raw bytes
+        and the position right after the 0x00 terminator."""
+        ops = self.ops
+        texts = self.texts
+        doubles = self.doubles
+        out = []
+        dropped = []
+        start = pos = offset
+
+        while True:
+            b = data[pos]
+            pos += 1
+            op = ops[b]
+
+            if op == OP_CHAR:
+                out.append(texts[b])
+
+            elif op == OP_END:
+                break
+
+            elif op == OP_DOUBLE or op == OP_BUTTON:
+                v = data[pos]
+                pos += 1
+                if op == OP_BUTTON and self.buttons[v] is not None:
+                    out.append(self.buttons[v])
+                else:
+                    out.append(doubles[(b << 8) | v])
+
+            elif op == OP_VOICE:
+                end = pos
+                while data[end] != 0x29:
+                    end += 1
+                val = bytes(data[pos:end]).decode("cp932")
+                out.append(val.replace('(', '<') + ">")
+                pos = end + 1
+
+            else:
+                # Tags with a parameter between parenthesis
+                if data[pos] == 0x28:
+                    end = pos + 1
+                    while data[end] != 0x29:
+                        end += 1
+                    parameter = int.from_bytes(data[pos + 1:end], "big")
+                    tag_param = self.tag_params[b].get(parameter, None)
+
+                    if tag_param is not None:
+                        out.append(f"<{tag_param}>")
+                    else:
+                        out.append(f"<{self.tag_names[b]}:{parameter}>")
+                    pos = end + 1
+                else:
+                    # The byte read is lost, like in bytes_to_text
+                    dropped.append(pos)
+                    pos += 1
+                    out.append(texts[b])
+
+        end = pos - 1
+        if dropped:
+            raw = bytearray()
+            prev = start
+            for d in dropped:
+                raw += data[prev:d]
+                prev = d + 1
+            raw += data[prev:end]
+            raw = bytes(raw)
+        else:
+            raw = bytes(data[start:end])
+
+        return "".join(out), raw, pos
+
+
+def int_to_bytes(value: int) -> bytes:
+    return value.to_bytes(max(1, (value.bit_length() + 7) // 8), 'big')
+
+
+class CharTable(dict):
+    # Characters missing from the TBL are encoded in cp932 once and kept
+    def __missing__(self, c):
+        value = c.encode("cp932")
+        self[c] = value
+        return value
+
+
+class TextEncoder:
+    """Encode text to TOH bytes with everything resolved ahead of time.
+
+    Same output as text_to_bytes: the token patterns are compiled once,
+    every tag is looked up in a single tag -> bytes index and characters
+    go through a char -> bytes table.
+    """
+
+    def __init__(self, tbl_tags: dict):
+        self.token_regex = re.compile(HEX_TAG + "|" + COMMON_TAG + r"|(\n)")
+        self.voice_regex = re.compile("|".join(VALID_VOICEID))
+
+        itags = {v: k for k, v in tbl_tags['TAGS'].items()}
+        itags_upper = {v.upper(): k for k, v in tbl_tags['TAGS'].items()}
+        self.icon = itags.get("icon")
+
+        # Single index for TAGS/NAME/COLOR/BUTTON and any other table
+        # Bubble is always 0x0C, even when no table has it
+        self.tags = {"Bubble": b'\x0C'}
+        tables = [(k, {v2: k2 for k2, v2 in v.items()}) for k, v in tbl_tags.items() if k not in ['TAGS', 'TBL']]
+        names = set(itags).union(*[v.keys() for _, v in tables])
+        for tag in names:
+            if tag == "icon" or tag == "Bubble" or self.voice_regex.match(tag):
+                continue
+            if tag in itags:
+                self.tags[tag] = struct.pack("B", itags[tag])
+            else:
+                value = b''
+                for k, v in tables:
+                    if tag in v:
+                        if k in ['NAME', 'COLOR']:
+                            value += struct.pack('B', itags_upper[k]) + b'\x28' + int_to_bytes(v[tag]) + b'\x29'
+                            break
+                        else:
+                            value += b'\x81' + int_to_bytes(v[tag])
+                self.tags[tag] = value
+
+        # Printable characters are kept as is, the rest goes through the TBL
+        self.chars = CharTable()
+        for c, v in tbl_tags['TBL'].items():
+            self.chars[v] = c.to_bytes(2, 'big')
+        for c in PRINTABLE_CHARS + "\u3000":
+            self.chars[c] = c.encode("cp932")
+
+    def encode(self, text: str) -> bytes:
+        output = bytearray()
+        chars = self.chars
+        tags = self.tags
+
+        # split gives [text, hex, tag, newline, text, ...]
+        parts = self.token_regex.split(text)
+        for i in range(0, len(parts), 4):
+            t = parts[i]
+            if t:
+                output += b''.join(map(chars.__getitem__, t))
+
+            if i + 1 >= len(parts):
+                break
+
+            hex_tag, tag_token, new_line = parts[i + 1:i + 4]
+            if hex_tag is not None:
+                output.append(int(hex_tag[1:3], 16))
+
+            elif tag_token is not None:
+                tag, param, *_ = tag_token[1:-1].split(":") + [None]
+                value = tags.get(tag)
+                if value is not None:
+                    output += value
+                elif tag == "icon":
+                    output.append(self.icon)
+                    output += b'\x28' + struct.pack('B', int(param)) + b'\x29'
+                elif self.voice_regex.match(tag):
+                    output += b'\x09\x28' + tag.encode("cp932") + b'\x29'
+
+            else:
+                output += b"\x0A"
+
+        return bytes(output)
+
+
+class TextCodec:
+    def __init__(self, path: Path):
+        self.path = path
+        self.jsonTblTags, self.ijsonTblTags, self.iTags = read_tables(path)
+        self.decoder = TextDecoder(self.jsonTblTags)
+        self.encoder = TextEncoder(self.jsonTblTags)
+
+
+# One codec per encoding table, only built the first time it's needed
+codecs: dict[Path, TextCodec] = {}
+default_table_path = DEFAULT_TABLE_PATH
+default_codec: Optional[TextCodec] = None
+
+
+def load_codec(path: Union[Path, str]) -> TextCodec:
+    path = Path(path).resolve()
+    codec = codecs.get(path)
+    if codec is None:
+        codec = TextCodec(path)
+        codecs[path] = codec
+    return codec
+
+
+def get_codec(path: Union[Path, str, None] = None) -> TextCodec:
+    global default_codec
+    if path is not None:
+        return load_codec(path)
+
+    if default_codec is None:
+        default_codec = load_codec(default_table_path)
+    return default_codec
+
+
+def set_default_table(path: Union[Path, str]) -> TextCodec:
+    # Used by bytes_to_text and text_to_bytes from now on
+    global default_table_path, default_codec
+    default_table_path = Path(path)
+    default_codec = load_codec(path)
+    return default_codec
+
+
+def __getattr__(name):
+    # The old module level tables are still reachable, but built lazily
+    if name in ['jsonTblTags', 'ijsonTblTags', 'iTags']:
+        return getattr(get_codec(), name)
+    if name == 'text_decoder':
+        return get_codec().decoder
+    if name == 'text_encoder':
+        return get_codec().encoder
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
 def bytes_to_text(src: FileIO, offset: int = -1) -> (str, bytes):
+    codec = get_codec()
+    jsonTblTags = codec.jsonTblTags
     finalText = ""
     chars = jsonTblTags['TBL']
 
     if (offset > 0):
         src.seek(offset, 0)
+
+    # In memory files are decoded in one go with the tables
+    if isinstance(src.f, (BytesIO, MemoryReader)):
+        with src.f.getbuffer() as data:
+            finalText, buffer, end = codec.decoder.decode(data, src.tell())
+        src.seek(end)
+        return finalText, buffer
+
     buffer = []
     while True:
         b = src.read(1)
@@ -128,56 +477,4 @@ def bytes_to_text(src: FileIO, offset: int = -1) -> (str, bytes):
 
 
 def text_to_bytes(text:str):
-    multi_regex = (HEX_TAG + "|" + COMMON_TAG + r"|(\n)")
-    tokens = [sh for sh in re.split(multi_regex, text) if sh]
-    output = b''
-    for t in tokens:
-        # Hex literals
-        if re.match(HEX_TAG, t):
-            output += struct.pack("B", int(t[1:3], 16))
-
-        # Tags
-
-        elif re.match(COMMON_TAG, t):
-            tag, param, *_ = t[1:-1].split(":") + [None]
-
-            if tag == "icon":
-                output += struct.pack("B", ijsonTblTags["TAGS"].get(tag))
-                output += b'\x28' + struct.pack('B', int(param)) + b'\x29'
-
-            elif any(re.match(possible_value, tag)  for possible_value in VALID_VOICEID):
-                output += b'\x09\x28' + tag.encode("cp932") + b'\x29'
-
-            elif tag == "Bubble":
-                output += b'\x0C'
-
-            else:
-                if tag in ijsonTblTags["TAGS"]:
-                    output += struct.pack("B", ijsonTblTags["TAGS"][tag])
-                    continue
-
-                for k, v in ijsonTblTags.items():
-                    if tag in v:
-                        if k in ['NAME', 'COLOR']:
-                            output += struct.pack('B',iTags[k]) + b'\x28' + bytes.fromhex(v[tag]) + b'\x29'
-                            break
-                        else:
-                            output += b'\x81' + bytes.fromhex(v[tag])
-
-        # Actual text
-        elif t == "\n":
-            output += b"\x0A"
-        else:
-            for c in t:
-                if c in PRINTABLE_CHARS or c == "\u3000":
-                    output += c.encode("cp932")
-                else:
-
-                    if c in ijsonTblTags["TBL"].keys():
-                        b = ijsonTblTags["TBL"][c].to_bytes(2, 'big')
-                        output += b
-                    else:
-                        output += c.encode("cp932")
-
-
-    return output
\ No newline at end of file
+    return get_codec().encoder.encode(text)
@@ -1,8 +1,11 @@
+import hashlib
+from array import array
+from collections import OrderedDict
 from io import BytesIO
 from pathlib import Path
 from typing import Generator, Union
 
-from .FileIO import FileIO
+from .FileIO import FileIO, MemoryReader
 from .theirsce_funcs import *
 from .theirsce_instructions import *
 
@@ -18,6 +21,167 @@ class subsection:
     off:  int
 
 
+@dataclass
+class TheirsceCode:
+    # Code section decoded once, instruction i is types[i] (InstructionType value)
+    # at positions[i] with its main operand in operands[i]:
+    # ALU operation, PUSH value, SYSCALL index, BRANCH/LOCAL_CALL destination,
+    # RETURN is_void, ACQUIRE variables, BREAK param, STRING/REF offset
+    types: array
+    positions: array
+    operands: array
+    # Instruction index and offset of every STRING
+    string_indexes: array
+    string_offsets: array
+
+    def __len__(self) -> int:
+        return len(self.types)
+
+
+# Size of each instruction by opcode, 0 for ACQUIRE (0xF6)
+# which depends on its parameters
+INSTRUCTION_SIZES = bytes(
+    [3 if opcode & 8 else 2 for opcode in range(0x80)]
+    + [1] * 0x40
+    + [(1, 2, 3, 5)[(opcode >> 3) & 3] for opcode in range(0xC0, 0xE0)]
+    + [2] * 0x10
+    + [1, 1, 3, 3, 3, 5, 0, 3]
+    + [3] * 4
+    + [1] * 4
+)
+# ACQUIRE with 0xFF variables of 3 bytes
+MAX_INSTRUCTION_SIZE = 2 + 0xFF * 3
+# Read size for the tags of files that are not in memory
+TAG_CHUNK_SIZE = 0x40
+
+
+def instruction_boundaries(data, start: int, end: int) -> Generator[int, None, None]:
+    # Position of every instruction from start up to end
+    sizes = INSTRUCTION_SIZES
+    pos = start
+    while pos < end:
+        yield pos
+        size = sizes[data[pos]]
+        if size == 0:
+            size = 2
+            for _ in range(data[pos + 1]):
+                size += 3 if data[pos + size] & 8 else 2
+        pos += size
+
+
+def find_tag_end(data, start: int) -> int:
+    for pos in instruction_boundaries(data, start, len(data)):
+        if data[pos] == 0x80:
+            return pos + 1
+    return len(data)
+
+
+# Decoded code sections by hash of their content
+CODE_CACHE_SIZE = 256
+code_cache: "OrderedDict[tuple[bytes, int], TheirsceCode]" = OrderedDict()
+
+
+def decode_code(data: bytes, code_offset: int, start: int, end: int) -> TheirsceCode:
+    # Same decoding as Theirsce.read_opcode without making any object
+    types = array('B'); positions = array('L'); operands = array('l')
+    string_indexes = array('L'); string_offsets = array('L')
+    REFERENCE = InstructionType.REFERENCE.value; ALU = InstructionType.ALU.value
+    PUSH = InstructionType.PUSH.value; SYSCALL = InstructionType.SYSCALL.value
+    RETURN = InstructionType.RETURN.value; BRANCH = InstructionType.BRANCH.value
+    LOCAL_CALL = InstructionType.LOCAL_CALL.value; ACQUIRE = InstructionType.ACQUIRE.value
+    BREAK = InstructionType.BREAK.value; STRING = InstructionType.STRING.value
+    SP_REF = InstructionType.SP_REF.value
+
+    pos = start
+    while pos < end:
+        opcode = data[pos]
+        positions.append(pos)
+
+        # Reference Block
+        if opcode < 0x80:
+            if opcode & 8:
+                value = data[pos + 1] | (data[pos + 2] << 8)
+                size = 3
+            else:
+                value = data[pos + 1]
+                size = 2
+
+            if (opcode >> 4) & 7 == 0:
+                if size == 2:
+                    value |= (opcode & 3) << 8
+                value = (value >> 3) & 0xFF
+            else:
+                value |= (opcode & 3) << (8 * (size - 1))
+
+            if opcode & 4 == 0 and value >= 0x400:
+                value -= 0x400
+            types.append(REFERENCE); operands.append(value)
+            pos += size
+
+        elif opcode < 0xC0:
+            types.append(ALU); operands.append(opcode & 0x3F)
+            pos += 1
+
+        elif opcode < 0xE0:
+            size_mask = (opcode >> 3) & 3
+            signed = opcode & 4 != 0
+            top = opcode & 7
+
+            if size_mask == 0:
+                value = 0xFFFFFF00 | (top | 0xF8) if signed else top
+            elif size_mask == 1:
+                value = top << 8 | data[pos + 1]
+                value = value | 0xFFFF0000 | 0xF800 if signed else value
+            elif size_mask == 2:
+                value = top << 16 | data[pos + 1] | (data[pos + 2] << 8)
+                value = value | 0xFF000000 | 0xF80000 if signed else value
+            else:
+                value = int.from_bytes(data[pos + 1:pos + 5], "little")
+            value = value | (-(value & 0x80000000))
+
+            types.append(PUSH); operands.append(value)
+            pos += (1, 2, 3, 5)[size_mask]
+
+        elif opcode < 0xF0:
+            types.append(SYSCALL); operands.append(((opcode & 0xF) << 8) | data[pos + 1])
+            pos += 2
+
+        elif opcode < 0xF2:
+            types.append(RETURN); operands.append(opcode == 0xF0)
+            pos += 1
+
+        elif opcode < 0xF5:
+            types.append(BRANCH); operands.append(code_offset + (data[pos + 1] | (data[pos + 2] << 8)))
+            pos += 3
+
+        elif opcode == 0xF5:
+            types.append(LOCAL_CALL); operands.append(code_offset + (data[pos + 1] | (data[pos + 2] << 8)))
+            pos += 5
+
+        elif opcode == 0xF6:
+            variables = data[pos + 1]
+            types.append(ACQUIRE); operands.append(variables)
+            pos += 2
+            for _ in range(variables):
+                pos += 3 if data[pos] & 8 else 2
+
+        elif opcode == 0xF7:
+            types.append(BREAK); operands.append(data[pos + 1] | (data[pos + 2] << 8))
+            pos += 3
+
+        elif opcode < 0xFC:
+            value = ((opcode & 3) << 16) | data[pos + 1] | (data[pos + 2] << 8)
+            string_indexes.append(len(types)); string_offsets.append(value)
+            types.append(STRING); operands.append(value)
+            pos += 3
+
+        else:
+            types.append(SP_REF); operands.append(0)
+            pos += 1
+
+    return TheirsceCode(types, positions, operands, string_indexes, string_offsets)
+
+
 class Theirsce(FileIO):
     def __init__(self, path: Union[Path, str, BytesIO, bytes] ="") -> None:
         super().__init__(path, "r+b", "<")
@@ -55,72 +219,78 @@ class Theirsce(FileIO):
     def __exit__(self, exc_type, exc_value, traceback):
         return super().__exit__(exc_type, exc_value, traceback)
         
-    def walk_code(self, start=None, end=None) -> Generator[TheirsceBaseInstruction, None, None]:
+    def get_data(self) -> bytes:
+        pos = self.tell()
+        self.seek(0)
+        data = self.read()
+        self.seek(pos)
+        return data
+
+    def instruction_boundaries(self, start=None, end=None) -> list[int]:
         start = self.code_offset if start is None else start
         end = self.strings_offset if end is None else end
 
-        self.seek(start)
+        # Only the walked range is read, in memory the buffer is used as is
+        if isinstance(self._f, BytesIO):
+            with self._f.getbuffer() as data:
+                return list(instruction_boundaries(data, start, end))
+        data = self.read_at(start, end - start + MAX_INSTRUCTION_SIZE)
+        return [start + pos for pos in instruction_boundaries(data, 0, end - start)]
 
-        while self.tell() < end:
-            opcode = self.read_opcode()
-            pos = self.tell()
-            yield opcode
+    def walk_code(self, start=None, end=None) -> Generator[TheirsceBaseInstruction, None, None]:
+        for pos in self.instruction_boundaries(start, end):
             self.seek(pos)
+            yield self.read_opcode()
+
+    def decode_code(self) -> TheirsceCode:
+        # Whole code section as arrays, decoded once per content
+        if isinstance(self._f, BytesIO):
+            with self._f.getbuffer() as buffer, buffer[:self.strings_offset] as data:
+                return self._decode_code(data)
+        return self._decode_code(self.read_at(0, self.strings_offset))
+
+    def _decode_code(self, data) -> TheirsceCode:
+        key = (hashlib.sha1(data).digest(), self.code_offset)
+        code = code_cache.get(key)
+        if code is None:
+            code = decode_code(data, self.code_offset, self.code_offset, self.strings_offset)
+            code_cache[key] = code
+            if len(code_cache) > CODE_CACHE_SIZE:
+                code_cache.popitem(last=False)
+        else:
+            code_cache.move_to_end(key)
+        return code
 
     @staticmethod
     def read_tag_bytes(src) -> bytes:
-        data = b""
-        
-        while True:
-            c = src.read(1)
-            if c == b"\x80":
-                data += c
-                break
-
-            data += c
-            opcode = data[-1]
-            
-            if opcode < 0x80: 
-                if opcode & 8 != 0: 
-                    data += src.read(2)
-                else:
-                    data += src.read(1)
-                    
-            elif opcode < 0xC0:
-                continue
-
-            elif opcode < 0xE0:
-                size_mask = (opcode >> 3) & 3
-
-                if size_mask == 1: data += src.read(1)
-                elif size_mask == 2: data += src.read(2)
-                elif size_mask == 3: data += src.read(4)
-
-            elif opcode < 0xF0:
-                data += src.read(1)
-            
-            elif opcode < 0xF8:
-                if (0xF2 <= opcode < 0xF5) or opcode == 0xF7:
-                    data += src.read(2)
-                elif opcode == 0xF5:
-                    data += src.read(4)
-                elif opcode == 0xF6:
-                    data += src.read(1)
-                    for _ in range(data[-1]):
-                        cc = src.read_uint8()
-                        data += cc
-                        if cc & 8 != 0:
-                            data += src.read(2) 
-                        else:
-                            data += src.read(3)
-            
-            elif opcode < 0xFC:
-                data += src.read(2)
-            
-            elif opcode == 0xFE:
-                continue
+        # Instructions up to the first 0x80 one, taken in a single slice
+        f = src.f if isinstance(src, FileIO) else src
+        start = f.tell()
+
+        if isinstance(f, (BytesIO, MemoryReader)):
+            with f.getbuffer() as data:
+                tag = bytes(data[start:find_tag_end(data, start)])
+        else:
+            # Small reads until the 0x80 instruction, the last instruction
+            # is scanned again when it goes past what was read
+            data = bytearray()
+            pos, end = 0, None
+            while end is None:
+                chunk = f.read(TAG_CHUNK_SIZE)
+                data += chunk
+                try:
+                    for pos in instruction_boundaries(data, pos, len(data)):
+                        if data[pos] == 0x80:
+                            end = pos + 1
+                            break
+                except IndexError:
+                    pass
+                if not chunk and end is None:
+                    end = len(data)
+            tag = bytes(data[:end])
 
-        return data
+        f.seek(start + len(tag))
+        return tag
 
     def read_opcode(self) -> TheirsceBaseInstruction:
         pos = self.tell()
@@ -175,7 +345,7 @@ class Theirsce(FileIO):
 
             if size_mask == 0:
                 value = 0xFFFFFF00 | (top | 0xF8) if signed else top
-            if size_mask == 1:
+            elif size_mask == 1:
                 value = top << 8 | self.read_uint8()
                 value = value | 0xFFFF0000 | 0xF800 if signed else value
             elif size_mask == 2:
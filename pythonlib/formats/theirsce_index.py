@@ -0,0 +1,108 @@
+import hashlib
+import struct
+from pathlib import Path
+from typing import Optional
+
+from .theirsce import Theirsce
+
+# STRING instructions (F8..FB) hold 18 bits offsets, the
+# 2 high bits are in the opcode and the 16 low ones follow it
+STRING_OPCODE = 0xF8
+MAX_STRING_OFFSET = (1 << 18) - 1
+
+
+class StringIndex:
+    # Every string offset of a THEIRSCE with the position and opcode of the
+    # instructions using it, saved next to the extracted files so the code
+    # doesn't need to be decoded again
+    MAGIC = b"TSRI"
+    header_struct = struct.Struct("<4s20sII")
+
+    def __init__(self, file_hash: bytes, references: dict[int, list[tuple[int, int]]]) -> None:
+        self.file_hash = file_hash
+        self.references = references
+        self.positions = {pos: offset for offset, refs in references.items() for pos, _ in refs}
+
+    @staticmethod
+    def from_theirsce(theirsce: Theirsce) -> 'StringIndex':
+        data = theirsce.get_data()
+        code = theirsce.decode_code()
+
+        references: dict[int, list[tuple[int, int]]] = {}
+        for index, offset in zip(code.string_indexes, code.string_offsets):
+            pos = code.positions[index]
+            references.setdefault(offset, []).append((pos, data[pos]))
+        return StringIndex(hashlib.sha1(data).digest(), references)
+
+    @staticmethod
+    def from_bytes(data: bytes) -> 'StringIndex':
+        magic, file_hash, string_count, ref_count = StringIndex.header_struct.unpack_from(data)
+        if magic != StringIndex.MAGIC:
+            raise ValueError("Not a THEIRSCE string index!")
+
+        pos = StringIndex.header_struct.size
+        offsets = struct.unpack_from(f"<{string_count}I", data, pos); pos += 4 * string_count
+        counts = struct.unpack_from(f"<{string_count}H", data, pos); pos += 2 * string_count
+        positions = struct.unpack_from(f"<{ref_count}I", data, pos); pos += 4 * ref_count
+        opcodes = data[pos:pos + ref_count]
+
+        references = {}
+        start = 0
+        for offset, count in zip(offsets, counts):
+            references[offset] = list(zip(positions[start:start + count], opcodes[start:start + count]))
+            start += count
+        return StringIndex(file_hash, references)
+
+    def to_bytes(self) -> bytes:
+        offsets = sorted(self.references)
+        refs = [ref for offset in offsets for ref in self.references[offset]]
+
+        return b"".join([
+            self.header_struct.pack(self.MAGIC, self.file_hash, len(offsets), len(refs)),
+            struct.pack(f"<{len(offsets)}I", *offsets),
+            struct.pack(f"<{len(offsets)}H", *[len(self.references[offset]) for offset in offsets]),
+            struct.pack(f"<{len(refs)}I", *[pos for pos, _ in refs]),
+            bytes(opcode for _, opcode in refs),
+        ])
+
+    @staticmethod
+    def load(path: Path, theirsce: Theirsce) -> Optional['StringIndex']:
+        # Only valid for the exact file it was made from
+        try:
+            index = StringIndex.from_bytes(Path(path).read_bytes())
+        except (FileNotFoundError, ValueError, struct.error):
+            return None
+
+        if index.file_hash != hashlib.sha1(theirsce.get_data()).digest():
+            return None
+        return index
+
+    def save(self, path: Path) -> None:
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        Path(path).write_bytes(self.to_bytes())
+
+    def get_pointers(self, offset: int) -> list[int]:
+        # The operand is right after the opcode
+        return [pos + 1 for pos, _ in self.references.get(offset, [])]
+
+    def is_pointer(self, pointer: int) -> bool:
+        return pointer - 1 in self.positions
+
+    @staticmethod
+    def fits(offset: int) -> bool:
+        return 0 <= offset <= MAX_STRING_OFFSET
+
+    def check(self, pointer: int, offset: int) -> None:
+        if not self.is_pointer(pointer):
+            raise ValueError(f"0x{pointer:X} is not the operand of a string instruction")
+        if not self.fits(offset):
+            raise ValueError(f"String offset 0x{offset:X} doesn't fit in 18 bits")
+
+    def patch(self, data: bytearray, pointer: int, offset: int) -> None:
+        self.check(pointer, offset)
+        data[pointer - 1:pointer + 2] = encode_string_instruction(offset)
+
+
+def encode_string_instruction(offset: int) -> bytes:
+    # Offsets over 16 bits also need the opcode to change
+    return bytes([STRING_OPCODE | (offset >> 16)]) + struct.pack("<H", offset & 0xFFFF)
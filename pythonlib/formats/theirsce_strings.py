@@ -0,0 +1,73 @@
+import struct
+import sys
+from typing import Optional
+
+from .theirsce_index import STRING_OPCODE, StringIndex
+
+
+def build_string_pool(strings: list[bytes], first: bytes = b"\x00") -> tuple[bytearray, list[int]]:
+    # Strings section with every string stored once, a string that is
+    # the end of another one (null included) points inside it
+    # Gives back the section and the offset of each string in it
+    unique = list(dict.fromkeys(string + b"\x00" for string in strings))
+
+    # Sorted on their reversed bytes, the strings that end another
+    # one come right before the longest string they end
+    hosts = {}
+    previous = None
+    for string in sorted(unique, key=lambda s: s[::-1], reverse=True):
+        if previous is not None and previous.endswith(string):
+            hosts[string] = hosts[previous]
+        else:
+            hosts[string] = string
+        previous = string
+
+    pool = bytearray(first)
+    placed = {}
+    for string in unique:
+        host = hosts[string]
+        if host not in placed:
+            placed[host] = len(pool)
+            pool += host
+
+    offsets = []
+    for string in strings:
+        host = hosts[string + b"\x00"]
+        offsets.append(placed[host] + len(host) - len(string) - 1)
+    return pool, offsets
+
+
+def build_theirsce(data: bytes, strings_offset: int, entries: list[tuple[list[int], bytes]],
+                   index: Optional[StringIndex] = None) -> bytes:
+    # New THEIRSCE with the strings of entries (pointers, encoded text)
+    # the code is kept as is and only the pointers are updated
+    pool, offsets = build_string_pool([text for _, text in entries], data[strings_offset:strings_offset + 1])
+
+    out = bytearray(data[:strings_offset])
+    out += pool
+
+    # One view of the 16 bits words for each alignment of the pointers
+    view = memoryview(out)
+    words = [view[start:start + ((len(out) - start) & ~1)].cast("H") for start in (0, 1)]
+    native = sys.byteorder == "little"
+
+    try:
+        for (pointers, _), offset in zip(entries, offsets):
+            for pointer in pointers:
+                # The index can also update the 2 high bits in the opcode
+                if index is not None:
+                    index.check(pointer, offset)
+                    out[pointer - 1] = STRING_OPCODE | (offset >> 16)
+                elif offset > 0xFFFF:
+                    raise ValueError(f"String offset 0x{offset:X} doesn't fit in 16 bits")
+
+                if native:
+                    words[pointer & 1][pointer >> 1] = offset & 0xFFFF
+                else:
+                    struct.pack_into("<H", out, pointer, offset & 0xFFFF)
+    finally:
+        for word in words:
+            word.release()
+        view.release()
+
+    return bytes(out)
@@ -18,6 +18,22 @@ bytecode_dict = {
     "Misc": [b'\x00\x00\x00\x82\x02', b'\x01\x00\x00\x82\x02', b'\x00\xA3\x04']
 }
 
+# All the bytecodes in one lookahead regex, one group per bytecode
+# so overlapping signatures are still found
+bytecode_list = [(section, bytecode) for section, bytecodes in bytecode_dict.items() for bytecode in bytecodes]
+bytecode_regex = re.compile(b'(?=' + b'|'.join(b'(' + re.escape(bytecode) + b')' for _, bytecode in bytecode_list) + b')')
+
+
+def scan_bytecodes(data) -> list[tuple[str, int]]:
+    # Single pass over the file, the hits are returned as (section, pointer_offset)
+    # in the same order as searching each bytecode one after another
+    hits = [[] for _ in bytecode_list]
+    for match_obj in bytecode_regex.finditer(data):
+        hits[match_obj.lastindex - 1].append(match_obj.start())
+
+    return [(section, offset + len(bytecode))
+            for (section, bytecode), offsets in zip(bytecode_list, hits) for offset in offsets]
+
 
 class Tss():
     def __init__(self, path:Path, bytes_to_text, text_to_bytes, list_status_insertion) -> None:
@@ -42,7 +58,8 @@ class Tss():
             (string.digits, string.ascii_letters, string.punctuation, " ")
         )
 
-        with FileIO(path) as tss_f:
+        # SCP files are small, keep them in memory for the text decoder
+        with FileIO(Path(path).read_bytes()) as tss_f:
 
             tss_f.read(12)
             self.strings_offset = struct.unpack('<I', tss_f.read(4))[0]
@@ -52,26 +69,18 @@ class Tss():
     def extract_all_pointers(self, f):
 
         self.id = 1
-        for section, bytecode_list in bytecode_dict.items():
-            for bytecode in bytecode_list:
-                regex = re.compile(bytecode)
-                f.seek(0)
-                data = f.read()
-
-                for match_obj in regex.finditer(data):
-                    offset = match_obj.start()
-                    pointer_offset = offset + len(bytecode)
+        f.seek(0)
+        data = f.read()
 
-
-                    f.seek(pointer_offset, 0)
-                    text_offset = struct.unpack('<H', f.read(2))[0] + self.strings_offset
-                    struct_node = StructNode(id=self.id, pointer_offset=pointer_offset,
-                                              text_offset=text_offset,
-                                              tss=f, strings_offset=self.strings_offset, file_size=self.file_size,
-                                           section=section)
-                    self.speaker_id = struct_node.add_speaker_entry(self.speaker_dict, self.speaker_id)
-                    self.struct_dict[pointer_offset] = struct_node
-                    self.id += 1
+        for section, pointer_offset in scan_bytecodes(data):
+            text_offset = struct.unpack_from('<H', data, pointer_offset)[0] + self.strings_offset
+            struct_node = StructNode(id=self.id, pointer_offset=pointer_offset,
+                                      text_offset=text_offset,
+                                      tss=f, strings_offset=self.strings_offset, file_size=self.file_size,
+                                   section=section)
+            self.speaker_id = struct_node.add_speaker_entry(self.speaker_dict, self.speaker_id)
+            self.struct_dict[pointer_offset] = struct_node
+            self.id += 1
 
 
 
@@ -206,16 +215,24 @@ class Tss():
             tss.write(speaker.bytes)
             tss.write(b'\x00')
 
-    def parse_xml_infos(self):
+    def index_xml_entries(self) -> dict[int, dict[tuple[int, int], etree.Element]]:
+
+        # Group the entries by PointerOffset then (SubId, BubbleId) in one pass
+        # the first entry found is kept like the previous list search
+        entries_index = {}
+        for entry in self.root.iterfind('Strings/Entry'):
+            pointer_offset = int(entry.findtext("PointerOffset"))
+            key = (int(entry.findtext("SubId")), int(entry.findtext("BubbleId")))
+            entries_index.setdefault(pointer_offset, {}).setdefault(key, entry)
 
-        struct_entries = self.root.findall('Strings/Entry')
-        pointers_list = list(set([int(entry.find("PointerOffset").text) for entry in struct_entries]))
+        return entries_index
+
+    def parse_xml_infos(self):
 
-        pointers_list.sort()
+        entries_index = self.index_xml_entries()
 
-        for pointer_offset in pointers_list:
-            entries = [entry for entry in struct_entries if int(entry.find("PointerOffset").text) == pointer_offset]
-            self.struct_dict[pointer_offset].parse_xml_nodes(entries, self.list_status_insertion)
+        for pointer_offset in sorted(entries_index.keys()):
+            self.struct_dict[pointer_offset].parse_xml_nodes(entries_index[pointer_offset], self.list_status_insertion)
 
     def copy_translations(self, original_path:Path, translated_path:Path):
 
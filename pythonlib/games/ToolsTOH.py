@@ -1,3 +1,4 @@
+import hashlib
 import os
 import shutil
 from os import stat_result
@@ -10,10 +11,15 @@ import pyjson5 as json
 import subprocess
 import datetime
 import lxml.etree as etree
-from pythonlib.formats.FileIO import FileIO
+from pythonlib.formats.FileIO import FileIO, MemoryReader
 from pythonlib.formats.fps4 import Fps4
 from pythonlib.formats.tss import Tss
+from pythonlib.formats.text_toh import set_default_table
 from pythonlib.utils.dsv2sav import sav_to_dsv
+from pythonlib.utils import nds_lz
+from pythonlib.utils.build_state import BuildState
+from pythonlib.utils.filecopy import copy_file
+from pythonlib.utils.parallel import map_jobs
 import re
 from itertools import chain
 import io
@@ -35,8 +41,6 @@ class ToolsTOH(ToolsTales):
 
 
         self.folder_name = 'TOH'
-        self.jsonTblTags = {}
-        self.ijsonTblTags = {}
         with open(project_file, encoding="utf-8") as f:
             json_raw = json.load(f)
 
@@ -46,19 +50,13 @@ class ToolsTOH(ToolsTales):
 
         # super().__init__("TOR", str(self.paths["encoding_table"]), "Tales-Of-Rebirth")
 
-        with open(self.paths["encoding_table"], encoding="utf-8") as f:
-            json_raw = json.load(f)
-
-        for k, v in json_raw.items():
-            self.jsonTblTags[k] = {int(k2, 16): v2 for k2, v2 in v.items()}
-
-
-        for k, v in self.jsonTblTags.items():
-            if k in ['TAGS', 'TBL']:
-                self.ijsonTblTags[k] = {v2:k2 for k2, v2 in v.items()}
-            else:
-                self.ijsonTblTags[k] = {v2: hex(k2).replace('0x', '').upper() for k2, v2 in v.items()}
-        self.iTags = {v2.upper(): k2 for k2, v2 in self.jsonTblTags['TAGS'].items()}
+        # Shared with the Tss/StructNode text functions
+        self.codec = set_default_table(self.paths["encoding_table"])
+        self.jsonTblTags = self.codec.jsonTblTags
+        self.ijsonTblTags = self.codec.ijsonTblTags
+        self.iTags = self.codec.iTags
+        self.text_decoder = self.codec.decoder
+        self.text_encoder = self.codec.encoder
         self.id = 1
 
         # byteCode
@@ -114,7 +112,7 @@ class ToolsTOH(ToolsTales):
         new_iso = f"TalesofHearts_{n.year:02d}{n.month:02d}{n.day:02d}{n.hour:02d}{n.minute:02d}.nds"
         print(f'Making Iso {new_iso}...')
         self.new_iso = new_iso
-        shutil.copy(game_iso, self.paths['game_builds'] / new_iso)
+        copy_file(game_iso, self.paths['game_builds'] / new_iso, desc=f'Copying {Path(game_iso).name}')
 
         path = self.folder_name / self.paths["final_files"]
 
@@ -164,25 +162,42 @@ class ToolsTOH(ToolsTales):
             f.seek(0)
             return f.read()
 
-    def update_overlays(self, romnds: rom, overlays_id: list):
+    def update_overlays(self, romnds: rom, overlays_id: list, jobs:int = 1):
         table = loadOverlayTable(romnds.arm9OverlayTable, lambda x, y: bytes())
 
-        for id in overlays_id:
-            ov3 = table[id]
-            ov3.compressed = True
+        #Only the edited overlays are compressed and replaced, in a single pass
+        changed = self.get_changed_overlays(overlays_id)
+        compressed = self.compress_overlays(changed, jobs=jobs)
 
-            self.compress_overlays()
-            with open(self.paths['final_files'] / f'overlay/overlay_000{id}.bin', 'rb') as f:
-                data_compressed = f.read()
+        #Compressed copies of overlays back to their original content are removed
+        for id in [id for id in overlays_id if id not in changed]:
+            (self.paths['final_files'] / 'overlay' / f'overlay_{id:04d}.bin').unlink(missing_ok=True)
 
-            ov3.compressedSize = len(data_compressed)
-            romnds.files[ov3.fileID] = data_compressed
+        for id, data_compressed in compressed.items():
+            overlay = table[id]
+            overlay.compressed = True
+            overlay.compressedSize = len(data_compressed)
+            romnds.files[overlay.fileID] = data_compressed
 
         romnds.arm9OverlayTable = saveOverlayTable(table)
 
 
 
-    def save_iso(self, game_iso:Path):
+    def get_rom_inputs(self, state:BuildState, game_iso:Path) -> dict:
+        path = Path(self.paths['final_files'])
+        return state.hash_files([game_iso, self.paths['temp_files'] / 'arm9' / 'arm9.bin',
+                                 *sorted((self.paths['temp_files'] / 'overlay').glob('overlay_*.bin')),
+                                 *sorted(file for file in path.rglob("*") if file.is_file())])
+
+    def save_iso(self, game_iso:Path, jobs:int = 1):
+
+        #Nothing to do when the files are the same as the last build
+        state = self.get_build_state()
+        previous = state.get_outputs('rom')
+        if not state.is_dirty('rom', self.get_rom_inputs(state, game_iso)) and len(previous) > 0:
+            self.new_iso = Path(next(iter(previous))).name
+            print(f'{self.new_iso} is up to date')
+            return
 
         self.clean_builds(self.paths["game_builds"])
         n: datetime.datetime = datetime.datetime.now()
@@ -211,9 +226,13 @@ class ToolsTOH(ToolsTales):
                     path_file = path_file.replace('data/', '')
                     romnds.setFileByName(path_file, data)
 
-        self.update_overlays(romnds, [0,3])
+        self.update_overlays(romnds, [0,3], jobs=jobs)
         romnds.saveToFile(self.paths['game_builds'] / self.new_iso)
 
+        #arm9.bin and the overlays of final_files are made while saving
+        state.set_node('rom', self.get_rom_inputs(state, game_iso), [self.paths['game_builds'] / self.new_iso])
+        state.save()
+
 
     def decompress_arm9(self):
 
@@ -234,7 +253,7 @@ class ToolsTOH(ToolsTales):
         #Copy the original file in a ARM9 folder
 
         #Compress the file using blz
-        print('Compressing Arm9 and Overlays...')
+        print('Compressing Arm9...')
         args = ['blz', '-en9', self.paths['final_files'] / 'arm9.bin']
         subprocess.run(args, cwd=Path.cwd() / 'pythonlib/utils', stdout = subprocess.DEVNULL)
 
@@ -266,13 +285,34 @@ class ToolsTOH(ToolsTales):
         args = ['blz', '-d', new_overlay / 'overlay*']
         subprocess.run(args, cwd=Path.cwd() / 'pythonlib/utils', stdout = subprocess.DEVNULL)
 
-    def compress_overlays(self):
+    def get_changed_overlays(self, overlays_id: list) -> list:
+        #Overlays of temp_files that differ from the extracted (decompressed) ones
+        changed = []
+        for id in overlays_id:
+            updated_path = self.paths['temp_files'] / 'overlay' / f'overlay_{id:04d}.bin'
+            original_path = self.paths['extracted_files'] / 'overlay' / f'overlay_{id:04d}.bin'
+            if not updated_path.exists():
+                continue
+
+            if not original_path.exists() or \
+                    hashlib.sha1(updated_path.read_bytes()).digest() != hashlib.sha1(original_path.read_bytes()).digest():
+                changed.append(id)
+        return changed
+
+    def compress_overlays(self, overlays_id: list, jobs:int = 1) -> dict[int, bytes]:
 
         overlay_folder = self.paths['final_files'] / 'overlay'
         overlay_folder.mkdir(parents=True, exist_ok=True)
-        shutil.copy(self.paths['temp_files'] / 'overlay' / 'overlay_0003.bin', overlay_folder / 'overlay_0003.bin')
-        args = ['blz', '-en', overlay_folder / 'overlay_0003.bin']
-        subprocess.run(args, cwd=Path.cwd() / 'pythonlib/utils', stdout=subprocess.DEVNULL)
+
+        #Valid BLZ like blz -en, the bytes can differ from it
+        print('Compressing Overlays...')
+        names = [f'overlay_{id:04d}.bin' for id in overlays_id]
+        compressed = map_jobs(codeCompression.compress,
+                              [(self.paths['temp_files'] / 'overlay' / name).read_bytes() for name in names], jobs=jobs)
+
+        for name, data in zip(names, compressed):
+            (overlay_folder / name).write_bytes(data)
+        return dict(zip(overlays_id, compressed))
 
     def adjusted_y9(self, overlay_name):
 
@@ -329,26 +369,41 @@ class ToolsTOH(ToolsTales):
     def get_style_pointers(self, file: FileIO, ptr_range: tuple[int, int], base_offset: int, style: str) -> tuple[
         list[int], list[int]]:
 
-        file.seek(ptr_range[0])
         pointers_offset: list[int] = []
         pointers_value: list[int] = []
         split: list[str] = [ele for ele in re.split(r'([PT])|(\d+)', style) if ele]
 
-        while file.tell() < ptr_range[1]:
-            for step in split:
+        # Position of the steps in one repetition of the style,
+        # the whole range is then read at once
+        steps: list[tuple[str, int]] = []
+        step_size = 0
+        for step in split:
+            if step == "P":
+                steps.append((step, step_size))
+                step_size += 4
+            elif step == "T":
+                steps.append((step, step_size))
+            else:
+                step_size += int(step)
+
+        start, end = ptr_range
+        count = -(-(end - start) // step_size)
+        data = file.read_at(start, count * step_size)
+        pointer_struct = file.get_struct("I")
+
+        for base in range(start, start + count * step_size, step_size):
+            for step, step_offset in steps:
+                pos = base + step_offset
                 if step == "P":
-                    off = file.read_uint32()
+                    off = pointer_struct.unpack_from(data, pos - start)[0]
                     if base_offset != 0 and off == 0: continue
 
-                    if file.tell() - 4 < ptr_range[1]:
-                        pointers_offset.append(file.tell() - 4)
+                    if pos < end:
+                        pointers_offset.append(pos)
                         pointers_value.append(off - base_offset)
-                elif step == "T":
-                    off = file.tell()
-                    pointers_offset.append(off)
-                    pointers_value.append(off)
                 else:
-                    file.read(int(step))
+                    pointers_offset.append(pos)
+                    pointers_value.append(pos)
 
         return pointers_offset, pointers_value
 
@@ -375,7 +430,7 @@ class ToolsTOH(ToolsTales):
             else:
                 file_path = self.paths["original_files"] / entry["file_path"]
 
-            with FileIO(file_path, "rb") as f:
+            with FileIO(file_path.read_bytes(), "rb") as f:
                 xml_data = self.extract_menu_file(entry, f, keep_translations)
 
             with open(xml_path / (entry["friendly_name"] + ".xml"), "wb") as xmlFile:
@@ -490,6 +545,13 @@ class ToolsTOH(ToolsTales):
         if (offset > 0):
             src.seek(offset, 0)
 
+        # In memory files are decoded in one go with the tables
+        if isinstance(src.f, (io.BytesIO, MemoryReader)):
+            with src.f.getbuffer() as data:
+                finalText, _, end = self.text_decoder.decode(data, src.tell())
+            src.seek(end)
+            return finalText
+
         while True:
             b = src.read(1)
 
@@ -643,6 +705,8 @@ class ToolsTOH(ToolsTales):
         else:
             entries = root.iter("Entry")
 
+        # Texts and pointers are written in one pass at the end
+        f.start_journal(check_conflicts=True)
         for line in entries:
             hi = []
             lo = []
@@ -660,14 +724,13 @@ class ToolsTOH(ToolsTales):
             mlen = line.find("MaxLength")
             if mlen is not None:
                 max_len = int(mlen.text)
-                f.seek(flat_ptrs[0])
                 text_bytes = self.get_node_bytes(line,pad) + b"\x00"
                 if len(text_bytes) > max_len:
                     tqdm.write(
                         f"Line id {line.find('Id').text} ({line.find('JapaneseText').text}) too long, truncating...")
-                    f.write(text_bytes[:max_len - 1] + b"\x00")
+                    f.write_at(flat_ptrs[0], text_bytes[:max_len - 1] + b"\x00")
                 else:
-                    f.write(text_bytes + (b"\x00" * (max_len - len(text_bytes))))
+                    f.write_at(flat_ptrs[0], text_bytes + (b"\x00" * (max_len - len(text_bytes))))
                 continue
 
             text_bytes = self.get_node_bytes(line,pad) + b"\x00"
@@ -686,8 +749,7 @@ class ToolsTOH(ToolsTales):
                 print("Ran out of space")
                 raise ValueError(f'Ran out of space in file: {root.find("Strings").find("Section").text}')
 
-            f.seek(str_pos)
-            f.write(text_bytes)
+            f.write_at(str_pos, text_bytes)
             virt_pos = str_pos + base_offset
             for off in flat_ptrs:
                 f.write_uint32_at(off, virt_pos)
@@ -702,6 +764,10 @@ class ToolsTOH(ToolsTales):
                 f.write_uint16_at(_h, val_hi)
                 f.write_uint16_at(_l, val_lo)
 
+        journal = f.stop_journal()
+        for pos, size in journal.conflicts:
+            tqdm.write(f"{root.find('Strings').find('Section').text}: 0x{pos:X} ({size} bytes) written by more than one entry")
+
 
     def get_node_bytes(self, entry_node, pad=False) -> bytes:
 
@@ -733,13 +799,13 @@ class ToolsTOH(ToolsTales):
 
         return bytes_entry
 
-    def extract_all_skits(self, keep_translations=False):
+    def extract_all_skits(self, keep_translations=False, jobs:int = 1):
         type = 'skit'
         base_path = self.paths['extracted_files'] / self.file_dict[type]
         base_path.mkdir(parents=True, exist_ok=True)
         fps4 = Fps4(detail_path=self.paths['original_files'] / 'data' / 'fc' / 'fcscr.dat',
                     header_path=self.paths['original_files'] / 'data' / 'fc' / 'fcscr.b')
-        fps4.extract_files(destination_path=base_path, copy_path=self.paths['temp_files'] / self.file_dict['skit'], decompressed=True)
+        fps4.extract_files(destination_path=base_path, copy_path=self.paths['temp_files'] / self.file_dict['skit'], decompressed=True, jobs=jobs)
 
         self.paths['skit_xml'].mkdir(parents=True, exist_ok=True)
         self.paths['skit_original'].mkdir(parents=True, exist_ok=True)
@@ -757,96 +823,152 @@ class ToolsTOH(ToolsTales):
         tss.pack_tss_file(destination_path=destination_path,
                           xml_path=xml_path)
 
-    def pack_all_skits(self):
-        type = 'skit'
+    def get_build_state(self) -> BuildState:
+        return BuildState(self.paths['temp_files'] / 'build_state.json')
 
-        fps4 = Fps4(detail_path=self.paths['original_files'] / 'data' / 'fc' / 'fcscr.dat',
-                    header_path=self.paths['original_files'] / 'data' / 'fc' / 'fcscr.b')
-
-        xml_list, archive_list = self.find_changes('skit')
-
-        #Repack TSS files
-        for archive in tqdm(archive_list, total=len(archive_list), desc="Inserting Skits Files..."):
-            end_name = f"{self.file_dict[type]}/{archive}.FCBIN"
-            src = self.paths['extracted_files'] / end_name
-            tss_path = self.paths['temp_files'] / end_name
-            shutil.copy(src=src,
-                        dst=tss_path)
-            self.pack_tss(destination_path=tss_path,
-                          xml_path=self.paths['skit_xml'] / f'{archive}.xml')
+    def get_skit_inputs(self, state:BuildState) -> dict:
+        return state.get_outputs(*state.find_nodes(f"{self.file_dict['skit']}/", '.FCBIN'))
 
-            args = ['lzss', '-evn', tss_path]
-            subprocess.run(args, stdout=subprocess.DEVNULL)
+    def pack_all_skits(self, jobs:int = 1):
+        type = 'skit'
+        state = self.get_build_state()
 
-        #Repack FPS4 archive
-        final_path = self.paths['final_files'] / 'data' / 'fc'
-        final_path.mkdir(parents=True, exist_ok=True)
-        fps4.pack_file(updated_file_path=self.paths['temp_files'] / self.file_dict[type],
-                       destination_folder=final_path)
+        fps4 = Fps4(detail_path=self.paths['original_files'] / 'data' / 'fc' / 'fcscr.dat',
+                    header_path=self.paths['original_files'] / 'data' / 'fc' / 'fcscr.b', lazy=True)
+
+        changes = self.find_changes('skit', state)
+        try:
+            #Repack TSS files, the compression is done by the FPS4
+            updated_files = {}
+            for xml_path, end_name, inputs, translated in tqdm(changes, total=len(changes), desc="Inserting Skits Files..."):
+                tss_path = self.paths['temp_files'] / end_name
+                if translated:
+                    shutil.copy(src=self.paths['extracted_files'] / end_name,
+                                dst=tss_path)
+                    self.pack_tss(destination_path=tss_path,
+                                  xml_path=xml_path)
+                    updated_files[tss_path.name] = tss_path.read_bytes()
+                else:
+                    #Nothing to insert anymore, back to the original file
+                    tss_path.write_bytes(fps4.get_file(tss_path.name).data)
+
+            #Repack FPS4 archive only when one of its files changed
+            final_path = self.paths['final_files'] / 'data' / 'fc'
+            final_path.mkdir(parents=True, exist_ok=True)
+            node = f"{self.file_dict[type]}.dat"
+            if len(changes) > 0 or state.is_dirty(node, self.get_skit_inputs(state)):
+                fps4.pack_file(updated_file_path=self.paths['temp_files'] / self.file_dict[type],
+                               destination_folder=final_path, updated_files=updated_files, jobs=jobs)
+
+                #The TSS files are only final once compressed
+                for xml_path, end_name, inputs, translated in changes:
+                    state.set_node(end_name, inputs, [self.paths['temp_files'] / end_name])
+                state.set_node(node, self.get_skit_inputs(state), [final_path / 'fcscr.dat', final_path / 'fcscr.b'])
+        finally:
+            fps4.close()
+            state.save()
 
 
     def pack_mapbin_story(self, file_name, type):
         mapbin_folder = self.paths['temp_files'] / self.file_dict[type] / file_name
 
         fps4_mapbin = Fps4(detail_path=self.paths['extracted_files'] / self.file_dict[type] / f'{file_name}.MAPBIN',
-                           header_path=self.paths['extracted_files'] / self.file_dict[type] / f'{file_name}.B')
+                           header_path=self.paths['extracted_files'] / self.file_dict[type] / f'{file_name}.B', lazy=True)
 
         fps4_mapbin.pack_fps4_type1(updated_file_path=mapbin_folder,
                                     destination_folder=self.paths['temp_files'] / self.file_dict[type])
+        fps4_mapbin.close()
+
+    def restore_story_file(self, end_name:str):
+        #Original compressed SCP taken back from its MAPBIN
+        archive_path = (self.paths['extracted_files'] / end_name).parent
+        fps4_mapbin = Fps4(detail_path=archive_path.with_suffix('.MAPBIN'),
+                           header_path=archive_path.with_suffix('.B'), lazy=True)
+        (self.paths['temp_files'] / end_name).write_bytes(fps4_mapbin.get_file(Path(end_name).name).data)
+        fps4_mapbin.close()
+
     def pack_all_story(self):
         type = 'story'
-        # Copy original TSS files in the "updated" folder
+        state = self.get_build_state()
         dest = self.paths['temp_files'] / self.file_dict[type]
 
-        #Repack all the TSS that need to be updated based on status changed
-        xml_list, archive_list = self.find_changes('story')
-
-        if len(xml_list) > 0:
-            for xml_path in tqdm(xml_list, total=len(xml_list), desc='Inserting Story Files'):
-
-                if os.path.exists(xml_path):
-                    archive_name = xml_path.stem if not xml_path.stem.endswith('P') else xml_path.stem[0:-1]
-                    end_name = f"{self.file_dict['story']}/{archive_name}/{xml_path.stem}.SCP"
-                    src = self.paths['extracted_files'] / end_name
-                    tss_path = self.paths['temp_files'] / end_name
-                    shutil.copy(src=src,
+        #Repack the TSS that changed since the last build
+        changes = self.find_changes('story', state)
+        try:
+            for xml_path, end_name, inputs, translated in tqdm(changes, total=len(changes), desc='Inserting Story Files'):
+                tss_path = self.paths['temp_files'] / end_name
+                if translated:
+                    shutil.copy(src=self.paths['extracted_files'] / end_name,
                                 dst=tss_path)
                     self.pack_tss(destination_path=tss_path,
                                   xml_path=xml_path)
 
-                    args = ['lzss', '-evn', tss_path]
-                    subprocess.run(args, stdout = subprocess.DEVNULL)
-
-            # Find all the xmls that has changed recently
-            for archive in archive_list:
-                self.pack_mapbin_story(archive, type)
-
+                    tss_path.write_bytes(nds_lz.compress_lz10(tss_path.read_bytes()))
+                else:
+                    self.restore_story_file(end_name)
+                state.set_node(end_name, inputs, [tss_path])
+
+            #Repack the MAPBIN whose TSS changed
+            archives = sorted({Path(node).parent.name for node in state.find_nodes(f"{self.file_dict[type]}/", '.SCP')})
+            mapbin_nodes = []
+            for archive in archives:
+                node = f"{self.file_dict[type]}/{archive}.MAPBIN"
+                inputs = state.get_outputs(*state.find_nodes(f"{self.file_dict[type]}/{archive}/", '.SCP'))
+                if state.is_dirty(node, inputs):
+                    self.pack_mapbin_story(archive, type)
+                    state.set_node(node, inputs, [dest / f'{archive}.MAPBIN', dest / f'{archive}.B'])
+                mapbin_nodes.append(node)
+
+            #Repack m.dat when one of the MAPBIN changed
             folder = 'm'
-            base_path = self.paths['extracted_files'] / 'data' / folder
-            (self.paths['final_files'] / self.file_dict[type]).mkdir(parents=True, exist_ok=True)
-            fps4_m = Fps4(detail_path=self.paths['original_files'] / self.file_dict['story'] / f'{folder}.dat',
-                        header_path=self.paths['original_files'] / self.file_dict['story'] / f'{folder}.b')
-            fps4_m.pack_fps4_type1(updated_file_path=self.paths['temp_files'] / self.file_dict[type],
-                                   destination_folder=self.paths['final_files'] / self.file_dict[type])
-
-    def find_changes(self, type):
-
-        xml_list = []
-        archive_list = []
+            final_path = self.paths['final_files'] / self.file_dict[type]
+            node = f"{self.file_dict[type]}/{folder}.dat"
+            inputs = state.get_outputs(*mapbin_nodes)
+            if state.is_dirty(node, inputs):
+                final_path.mkdir(parents=True, exist_ok=True)
+                fps4_m = Fps4(detail_path=self.paths['original_files'] / self.file_dict['story'] / f'{folder}.dat',
+                            header_path=self.paths['original_files'] / self.file_dict['story'] / f'{folder}.b', lazy=True)
+                fps4_m.pack_fps4_type1(updated_file_path=dest,
+                                       destination_folder=final_path)
+                fps4_m.close()
+                state.set_node(node, inputs, [final_path / f'{folder}.dat', final_path / f'{folder}.b'])
+        finally:
+            state.save()
+
+    def get_end_name(self, type:str, xml_path:Path) -> str:
+        archive_name = xml_path.stem if not xml_path.stem.endswith('P') else xml_path.stem[0:-1]
+        if type == 'story':
+            return f"{self.file_dict[type]}/{archive_name}/{xml_path.stem}.SCP"
+        return f"{self.file_dict[type]}/{archive_name}.FCBIN"
+
+    def find_changes(self, type, state:BuildState):
+        #Only the XMLs edited since the last build are parsed again
+        changes = []
+        status = [str(status) for status in self.list_status_insertion]
+        #Every file is encoded again when the table changes
+        table = state.hash_file(self.paths['encoding_table'])
         for xml_path in [path for path in self.paths[f'{type}_xml'].iterdir() if 'git' not in path.name]:
+            end_name = self.get_end_name(type, xml_path)
+            inputs = {'xml': state.hash_file(xml_path),
+                      'source': state.hash_file(self.paths['extracted_files'] / end_name),
+                      'status': status,
+                      'table': table}
+            if not state.is_dirty(end_name, inputs):
+                continue
+
             tree = etree.parse(xml_path)
             root = tree.getroot()
             entries_translated = [entry for entry in root.iter('Entry') if entry.find('Status').text in self.list_status_insertion]
 
-
             if len(entries_translated) > 0:
-                archive_name = xml_path.stem if not xml_path.stem.endswith('P') else xml_path.stem[0:-1]
-                xml_list.append(xml_path)
-                archive_list.append(archive_name)
-
-        archive_list = list(set(archive_list))
+                changes.append((xml_path, end_name, inputs, True))
+            elif len(state.get_outputs(end_name)) > 0:
+                changes.append((xml_path, end_name, inputs, False))
+            else:
+                #Never inserted, nothing to build
+                state.set_node(end_name, inputs, [])
 
-        return xml_list, archive_list
+        return changes
 
     def extract_tss(self, tss_file:Path, file_type:str, keep_translations=False):
         tss_obj = Tss(path=tss_file, bytes_to_text=self.bytes_to_text,
@@ -860,14 +982,17 @@ class ToolsTOH(ToolsTales):
                                        keep_translations=keep_translations)
 
 
-    def extract_all_story(self, extract_XML=False):
+    def extract_all_story(self, extract_XML=False, jobs:int = 1):
         folder = 'm'
         base_path = self.paths['extracted_files'] / 'data' / folder
 
         fps4 = Fps4(detail_path=self.paths['original_files'] / 'data' / folder / f'{folder}.dat',
-                    header_path=self.paths['original_files'] / 'data' / folder / f'{folder}.b')
+                    header_path=self.paths['original_files'] / 'data' / folder / f'{folder}.b', lazy=True)
         copy_path = self.paths['temp_files'] / self.file_dict['story']
-        fps4.extract_files(destination_path=base_path, copy_path=copy_path)
+        try:
+            fps4.extract_files(destination_path=base_path, copy_path=copy_path)
+        finally:
+            fps4.close()
 
         self.paths['story_xml'].mkdir(parents=True, exist_ok=True)
         self.paths['story_original'].mkdir(parents=True, exist_ok=True)
@@ -879,7 +1004,7 @@ class ToolsTOH(ToolsTales):
             fps4_tss = Fps4(detail_path=file, header_path=file_header)
             folder_path = file.with_suffix('')
             folder_path.mkdir(parents=True, exist_ok=True)
-            fps4_tss.extract_files(destination_path=folder_path, copy_path=copy_path / file.stem, decompressed=True)
+            fps4_tss.extract_files(destination_path=folder_path, copy_path=copy_path / file.stem, decompressed=True, jobs=jobs)
 
             #Load the tss file
             for tss_file in [file_path for file_path in folder_path.iterdir() if file_path.suffix == '.SCP']:
@@ -920,57 +1045,4 @@ class ToolsTOH(ToolsTales):
 
 
     def text_to_bytes(self, text):
-        multi_regex = (self.HEX_TAG + "|" + self.COMMON_TAG + r"|(\n)")
-        tokens = [sh for sh in re.split(multi_regex, text) if sh]
-
-        output = b''
-        for t in tokens:
-            # Hex literals
-            if re.match(self.HEX_TAG, t):
-                output += struct.pack("B", int(t[1:3], 16))
-
-            # Tags
-            elif re.match(self.COMMON_TAG, t):
-                tag, param, *_ = t[1:-1].split(":") + [None]
-
-                if tag == "icon":
-                    output += struct.pack("B", self.ijsonTblTags["TAGS"].get(tag))
-                    output += b'\x28' + struct.pack('B', int(param)) + b'\x29'
-
-                elif any(re.match(possible_value, tag)  for possible_value in self.VALID_VOICEID):
-                    output += b'\x09\x28' + tag.encode("cp932") + b'\x29'
-
-                elif tag == "Bubble":
-                    output += b'\x0C'
-
-                else:
-                    if tag in self.ijsonTblTags["TAGS"]:
-                        output += struct.pack("B", self.ijsonTblTags["TAGS"][tag])
-                        continue
-
-                    for k, v in self.ijsonTblTags.items():
-                        if tag in v:
-                            if k in ['NAME', 'COLOR']:
-                                output += struct.pack('B',self.iTags[k]) + b'\x28' + bytes.fromhex(v[tag]) + b'\x29'
-                                break
-                            else:
-                                output += b'\x81' + bytes.fromhex(v[tag])
-
-            # Actual text
-            elif t == "\n":
-                output += b"\x0A"
-            else:
-                for c in t:
-                    if c in self.PRINTABLE_CHARS or c == "\u3000":
-                        output += c.encode("cp932")
-                    else:
-
-                        if c in self.ijsonTblTags["TBL"].keys():
-                            b = self.ijsonTblTags["TBL"][c].to_bytes(2, 'big')
-                            output += b
-                        else:
-                            output += c.encode("cp932")
-
-
-
-        return output
+        return self.text_encoder.encode(text)
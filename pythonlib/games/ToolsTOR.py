@@ -1,13 +1,18 @@
 import datetime
+import hashlib
+import mmap
+import os
 import re
 import shutil
 import struct
 import subprocess
 import types
+from collections import deque
 from collections.abc import Iterable
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass
-from itertools import tee
 from pathlib import Path
+from typing import Optional
 
 import lxml.etree as etree
 import pycdlib
@@ -17,13 +22,16 @@ from tqdm import tqdm
 
 import pythonlib.formats.pak2 as pak2lib
 import pythonlib.utils.comptolib as comptolib
+import pythonlib.utils.compto_cache as compto_cache
+from pythonlib.utils.filecopy import copy_stream, write_zeros
 from pythonlib.formats.FileIO import FileIO
 from pythonlib.formats.pak import Pak
 from pythonlib.formats.scpk import Scpk
 from pythonlib.formats.theirsce import Theirsce
+from pythonlib.formats.theirsce_index import StringIndex
+from pythonlib.formats.theirsce_strings import build_theirsce
 from pythonlib.formats.theirsce_instructions import (AluOperation,
-                                                     InstructionType,
-                                                     TheirsceBaseInstruction)
+                                                     InstructionType)
 
 from .ToolsTales import ToolsTales
 
@@ -43,6 +51,71 @@ class NameEntry:
 VARIABLE_NAME = "[VARIABLE]"
 
 
+# Module level so it can run in the make_iso worker processes
+# Gives back the hash of the source file with the data to write
+def load_dat_file(file: Optional[Path], comp_type: Optional[str]) -> tuple[Optional[str], bytes]:
+    if file is None:
+        return None, b""
+
+    with open(file, "rb") as f:
+        data = f.read()
+    file_hash = hashlib.sha1(data).hexdigest()
+
+    if comp_type != None:
+        data = compto_cache.compress_data(data, version=int(comp_type))
+    return file_hash, bytes(data)
+
+
+# Module level for the extract_main_archive worker processes
+# DAT.BIN is mapped once per process and the entries are sliced from it
+dat_map: Optional[mmap.mmap] = None
+dat_get_extension = None
+
+
+def open_dat_map(dat_path: Path, get_extension) -> None:
+    global dat_map, dat_get_extension
+    with open(dat_path, "rb") as f:
+        dat_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    dat_get_extension = get_extension
+
+
+def close_dat_map() -> None:
+    global dat_map
+    if dat_map is not None:
+        dat_map.close()
+        dat_map = None
+
+
+# Decompress, sniff and write one entry, the folders already exist
+def extract_dat_file(index: int, offset: int, size: int, out_path: Path) -> dict:
+    raw = dat_map[offset:offset + size]
+    c_type = None
+
+    if comptolib.is_compressed(raw):
+        c_type = struct.unpack("<b", raw[:1])[0]
+        data = comptolib.decompress_data(raw)
+        extension = dat_get_extension(data)
+        fname = f"{index:05d}.{c_type}.{extension}"
+    else:
+        data = raw
+        extension = dat_get_extension(data)
+        fname = f"{index:05d}.{extension}"
+
+    with open(out_path / extension.upper() / fname, "wb") as output:
+        output.write(data)
+
+    return {
+        "index": index,
+        "file": f"{extension.upper()}/{fname}",
+        "offset": offset,
+        "size": size,
+        "compression": c_type,
+        "extension": extension,
+        "hash": hashlib.sha1(raw).hexdigest(),
+        "data_hash": hashlib.sha1(data).hexdigest(),
+    }
+
+
 # Bandage method to override autocrlf settings for peple without git
 def get_blob_normalizer_custom(self):
     """Return a BlobNormalizer object."""
@@ -68,6 +141,10 @@ class ToolsTOR(ToolsTales):
     HIGH_BITS      = 0xFFFFFFC0
     LOW_BITS       = 0x3F
 
+    # Every extension get_extension can give back
+    DAT_EXTENSIONS = {*ToolsTales.MAGIC_CHECK.values(), "hd", "sq", "bd", "ovl",
+                      "pak0", "pak1", "pak2", "pak3", "apak", "tmsk", "bin"}
+
     
     def __init__(self, project_file: Path, insert_mask: list[str], changed_only: bool = False) -> None:
         base_path = project_file.parent
@@ -99,6 +176,9 @@ class ToolsTOR(ToolsTales):
         self.changed_only = changed_only
         self.repo_path = str(base_path)
 
+        # Unchanged files are not compressed again when repacking
+        compto_cache.set_default_cache()
+
 
     def get_repo_fixed(self):
         r = porcelain.Repo(self.repo_path)
@@ -116,6 +196,7 @@ class ToolsTOR(ToolsTales):
 
         for file in tqdm(list(scpk_path.glob("*.scpk"))):
             theirsce = Theirsce(Scpk.from_path(file).rsce)
+            self.get_string_index(file, theirsce)
             xml_text = self.get_xml_from_theirsce(theirsce, "Story")
             self.id = 1
             
@@ -135,13 +216,25 @@ class ToolsTOR(ToolsTales):
             with open(file, "rb") as pak:
                 theirsce = pak2lib.get_theirsce_from_pak2(pak.read())
             
-            xml_text = self.get_xml_from_theirsce(Theirsce(theirsce), "Skits")
+            theirsce = Theirsce(theirsce)
+            self.get_string_index(file, theirsce)
+            xml_text = self.get_xml_from_theirsce(theirsce, "Skits")
             
             xml_name = file.name.split(".")[0] + ".xml"
             with open(folder_path / xml_name, "wb") as xml:
                 xml.write(xml_text)
 
 
+    def get_string_index(self, file: Path, theirsce: Theirsce) -> StringIndex:
+        # Kept out of the DAT folder so it's never taken for a DAT.BIN file
+        index_path = self.paths["extracted_files"] / "DAT_INDEX" / file.parent.name / f"{file.name}.tsri"
+        index = StringIndex.load(index_path, theirsce)
+        if index is None:
+            index = StringIndex.from_theirsce(theirsce)
+            index.save(index_path)
+        return index
+
+
     # Extract THEIRSCE to XML
     def get_xml_from_theirsce(self, rsce: Theirsce, section: str) -> bytes:
      
@@ -228,112 +321,115 @@ class ToolsTOR(ToolsTales):
         #     for _, sub in enumerate(section):
         #         sections.append(sub.off)
 
-        # Setup three-way opcode generator
-        d = TheirsceBaseInstruction(); d.type = InstructionType.INVALID
-        a,b,c = tee(theirsce.walk_code(), 3)
-        next(a, d)
-        next(b, d); next(b, d)
-        next(c, d); next(c, d); next(c, d)
-
-        # Helper function, in the future I'll
-        # just use a list of opcodes
-        def skip():
-            next(a, d); next(a, d)
-            next(b, d); next(b, d)
-            next(c, d); next(c, d)
-        
+        # Instructions are looked at three by three, straight from
+        # the decoded arrays of the code section
+        code = theirsce.decode_code()
+        types, positions, operands = code.types, code.positions, code.operands
+        strings_offset = theirsce.strings_offset
+
+        BREAK = InstructionType.BREAK.value
+        REFERENCE = InstructionType.REFERENCE.value
+        STRING = InstructionType.STRING.value
+        ALU = InstructionType.ALU.value
+        SYSCALL = InstructionType.SYSCALL.value
+        ASSIGNMENT = AluOperation.ASSIGNMENT.value
         
         names = {VARIABLE_NAME: []}
         lines = []
         params = []
         used = False
-        for op1, op2, op3 in zip(a,b,c):
+
+        # The first instruction is never the start of a sequence
+        i = 1
+        while i + 2 < len(types):
+            t1, t2, t3 = types[i], types[i + 1], types[i + 2]
             # Debug
-            # if theirsce.tell() in sections:
+            # if positions[i] in sections:
             #     print()
             #     print("SECTION: ")
 
             # BREAK marks start of a local function
             # so local params are no longer in scope
-            if op1.type is InstructionType.BREAK:
+            if t1 == BREAK:
                 if used == False:
                     for param in params:
-                        text = self.bytes_to_text(theirsce, param.offset + theirsce.strings_offset)
-                        lines.append(LineEntry([], text, op1.position + 1))
+                        text = self.bytes_to_text(theirsce, operands[param] + strings_offset)
+                        lines.append(LineEntry([], text, positions[param] + 1))
                 params.clear()
-
+                i += 1
                 continue
 
             # This sequence mark the simple act of assigning
             # a string to a local variable, so we can detect
             # when they are used later in a function call
-            if (op1.type is InstructionType.REFERENCE
-                and op2.type is InstructionType.STRING 
-                and op3.type is InstructionType.ALU
-                and op3.operation == AluOperation.ASSIGNMENT 
+            if (t1 == REFERENCE
+                and t2 == STRING
+                and t3 == ALU
+                and operands[i + 2] == ASSIGNMENT
                 ):
-                params.append(op2)
-                skip()
+                params.append(i + 1)
+                i += 3
                 continue
 
             # This sequence represents the textbox call with
             # the name being a variable (NPCs do this)
-            if (op1.type is InstructionType.REFERENCE
-                and op2.type is InstructionType.STRING 
-                and op3.type is InstructionType.SYSCALL
-                and op3.function_index == 0x45
+            if (t1 == REFERENCE
+                and t2 == STRING
+                and t3 == SYSCALL
+                and operands[i + 2] == 0x45
                 ):
                 if len(params) >= 1:
-                    name = [self.bytes_to_text(theirsce, p.offset + theirsce.strings_offset) for p in params]
-                    [names.setdefault(n, []).append(p.position + 1) for n, p in zip(name, params)]
+                    name = [self.bytes_to_text(theirsce, operands[p] + strings_offset) for p in params]
+                    [names.setdefault(n, []).append(positions[p] + 1) for n, p in zip(name, params)]
                 elif len(params) == 0:
                     name = []
-                text = self.bytes_to_text(theirsce, op2.offset + theirsce.strings_offset)
-                lines.append(LineEntry(name, text, op2.position + 1))
+                text = self.bytes_to_text(theirsce, operands[i + 1] + strings_offset)
+                lines.append(LineEntry(name, text, positions[i + 1] + 1))
                 #print(f"{params}: {text}")
                 used = True
-                skip()
+                i += 3
                 continue
             
             # This sequence represents the textbox call with
             # the text being a variable (Notice boxes do this)
-            if (op1.type is InstructionType.STRING
-                and op2.type is InstructionType.REFERENCE 
-                and op3.type is InstructionType.SYSCALL
-                and op3.function_index == 0x45
+            if (t1 == STRING
+                and t2 == REFERENCE
+                and t3 == SYSCALL
+                and operands[i + 2] == 0x45
                 ):
-                name = [self.bytes_to_text(theirsce, op1.offset + theirsce.strings_offset)]
-                names.setdefault(name[0], []).append(op1.position + 1)
+                name = [self.bytes_to_text(theirsce, operands[i] + strings_offset)]
+                names.setdefault(name[0], []).append(positions[i] + 1)
                 for param in params:
-                    text = self.bytes_to_text(theirsce, param.offset + theirsce.strings_offset)
-                    lines.append(LineEntry(name, text, param.position + 1))
+                    text = self.bytes_to_text(theirsce, operands[param] + strings_offset)
+                    lines.append(LineEntry(name, text, positions[param] + 1))
                     #print(f"{text}: {name}")
                 used = True
                 params.clear()
-                skip()
+                i += 3
                 continue
             
             # This sequence represents a regular textbox call
             # where both fields are an string (everything else, save for skits)
-            if (op1.type is InstructionType.STRING
-                and op2.type is InstructionType.STRING
-                and op3.type is InstructionType.SYSCALL
-                and op3.function_index == 0x45
+            if (t1 == STRING
+                and t2 == STRING
+                and t3 == SYSCALL
+                and operands[i + 2] == 0x45
                 ):
-                name = [self.bytes_to_text(theirsce, op1.offset + theirsce.strings_offset)]
-                names.setdefault(name[0], []).append(op1.position + 1)
-                text = self.bytes_to_text(theirsce, op2.offset + theirsce.strings_offset)
-                lines.append(LineEntry(name, text, op2.position + 1))
+                name = [self.bytes_to_text(theirsce, operands[i] + strings_offset)]
+                names.setdefault(name[0], []).append(positions[i] + 1)
+                text = self.bytes_to_text(theirsce, operands[i + 1] + strings_offset)
+                lines.append(LineEntry(name, text, positions[i + 1] + 1))
                 #print(f"{name}: {text}")
-                skip()
+                i += 3
                 continue
             
             # Any other string in assorted code calls
-            if op1.type is InstructionType.STRING:
-                #print(theirsce.read_string_at(op1.offset + theirsce.strings_offset))
-                text = self.bytes_to_text(theirsce, op1.offset + theirsce.strings_offset)
-                lines.append(LineEntry([], text, op1.position + 1))
-                continue
+            if t1 == STRING:
+                #print(theirsce.read_string_at(operands[i] + strings_offset))
+                text = self.bytes_to_text(theirsce, operands[i] + strings_offset)
+                lines.append(LineEntry([], text, positions[i] + 1))
+
+            i += 1
         
         return names, lines
 
@@ -341,10 +437,10 @@ class ToolsTOR(ToolsTales):
     def extract_story_pointers_plain(self, theirsce: Theirsce):
         pointers_offset = []; texts_offset = []
 
-        for opcode in theirsce.walk_code():
-            if opcode.type == self.string_opcode:
-                pointers_offset.append(theirsce.tell() - 2) # Maybe check this later
-                texts_offset.append(opcode.offset + theirsce.strings_offset)
+        code = theirsce.decode_code()
+        for index, offset in zip(code.string_indexes, code.string_offsets):
+            pointers_offset.append(code.positions[index] + 1) # Maybe check this later
+            texts_offset.append(offset + theirsce.strings_offset)
                     
         return pointers_offset, texts_offset
 
@@ -448,44 +544,35 @@ class ToolsTOR(ToolsTales):
         return bytes_entry
     
     
-    def get_new_theirsce(self, theirsce: Theirsce, xml: Path) -> Theirsce:
+    def get_new_theirsce(self, theirsce: Theirsce, xml: Path, index: Optional[StringIndex] = None) -> bytes:
         
-        #To store the new text_offset and pointers to update
-        new_text_offsets = dict()
-              
         #Read the XML for the corresponding THEIRSCE
-        
         tree = etree.parse(xml)
         root = tree.getroot()
 
-        #Go at the start of the dialog
-        #Loop on every Entry and reinsert
-        theirsce.seek(theirsce.strings_offset + 1)
-        theirsce.truncate()
         nodes = [ele for ele in root.iter('Entry') if ele.find('Id').text != "-1"]
         nodes = [ele for ele in nodes if ele.find('PointerOffset').text != "-1"]
 
+        #Each entry keeps its own pointers and bytes, entries
+        #with the same PointerOffset are all reinserted
+        entries = []
         for entry_node in nodes:
+            pointers = [int(pointer) for pointer in entry_node.find("PointerOffset").text.split(",")]
 
-            #Add the PointerOffset and TextOffset
-            new_text_offsets[entry_node.find("PointerOffset").text] = theirsce.tell()
             #Use the node to get the new bytes
-            bytes_entry = self.get_node_bytes(entry_node)
-
-            #Write to the file
-            theirsce.write(bytes_entry + b'\x00')
-            
-        #Update the pointers based on the new text_offset of  the entries
-        for pointer_offset, text_offset in new_text_offsets.items():
-            
-            pointers_list = pointer_offset.split(",")
-            new_value = text_offset - theirsce.strings_offset
-
-            for pointer in pointers_list:
-                theirsce.seek(int(pointer))
-                theirsce.write( struct.pack("<H", new_value))
-            
-        return theirsce
+            entries.append((pointers, self.get_node_bytes(entry_node)))
+
+        # The index knows the real string instructions, writing anywhere
+        # else would break the code
+        if index is not None:
+            invalid = [pointer for pointers, _ in entries for pointer in pointers if not index.is_pointer(pointer)]
+            if len(invalid) > 0:
+                raise ValueError(f"{xml.name}: {len(invalid)} PointerOffset(s) are not string pointers "
+                                 f"({', '.join(str(pointer) for pointer in invalid[:10])}), "
+                                 "the XML needs to be extracted again")
+
+        #The strings section is rebuilt in memory and the pointers updated
+        return build_theirsce(theirsce.get_data(), theirsce.strings_offset, entries, index)
     
 
     def pack_all_skits(self):
@@ -515,10 +602,9 @@ class ToolsTOR(ToolsTales):
             pak2_obj = pak2lib.get_data(pak2_data)
 
             old_rsce = Theirsce(pak2_obj.chunks.theirsce)
+            index = self.get_string_index(file, old_rsce)
             xml_name = file.name.split(".")[0] + ".xml"
-            new_rsce = self.get_new_theirsce(old_rsce, xml_path / xml_name)
-            new_rsce.seek(0)
-            pak2_obj.chunks.theirsce = new_rsce.read()
+            pak2_obj.chunks.theirsce = self.get_new_theirsce(old_rsce, xml_path / xml_name, index)
             
             with open(out_path / file.name, "wb") as f:
                 f.write(pak2lib.create_pak2(pak2_obj))
@@ -542,37 +628,46 @@ class ToolsTOR(ToolsTales):
 
 
     # Extract the file DAT.BIN to the different directorties
-    def extract_main_archive(self) -> None:
+    def extract_main_archive(self, jobs: int = 1) -> None:
         dat_bin_path = self.paths["extracted_files"] / "DAT"
         dat_bin_path.mkdir(exist_ok=True)
         
         self.clean_folder(dat_bin_path)
 
+        for extension in self.DAT_EXTENSIONS:
+            (dat_bin_path / extension.upper()).mkdir(exist_ok=True)
+
+        # Ignore 0 byte files
+        entries = [(i, offset, size) for i, (offset, size) in enumerate(self.get_datbin_file_data()) if size != 0]
+        indexes, offsets, sizes = zip(*entries) if entries else ((), (), ())
+        out_paths = [dat_bin_path] * len(entries)
+
         print("Extracting DAT.BIN files...")
-        with open(self.paths["original_files"] / "DAT.BIN", "rb") as f:
-            for i, (offset, size) in enumerate(tqdm(self.get_datbin_file_data(), desc="Extracting files", unit="file")):
-                
-                # Ignore 0 byte files
-                if size == 0:
-                    continue
+        dat_path = self.paths["original_files"] / "DAT.BIN"
+        # Bound to the class so the workers don't get a pickled instance
+        get_extension = type(self).get_extension
+        if jobs > 1:
+            with ProcessPoolExecutor(max_workers=jobs, initializer=open_dat_map,
+                                     initargs=(dat_path, get_extension)) as executor:
+                results = executor.map(extract_dat_file, indexes, offsets, sizes, out_paths, chunksize=64)
+                manifest = list(tqdm(results, total=len(entries), desc="Extracting files", unit="file"))
+        else:
+            open_dat_map(dat_path, get_extension)
+            try:
+                manifest = [extract_dat_file(*entry, dat_bin_path)
+                            for entry in tqdm(entries, desc="Extracting files", unit="file")]
+            finally:
+                close_dat_map()
 
-                f.seek(offset, 0)
-                data = f.read(size)
-                
-                if comptolib.is_compressed(data):
-                    c_type = struct.unpack("<b", data[:1])[0]
-                    data = comptolib.decompress_data(data)
-                    extension = self.get_extension(data)
-                    fname = f"{i:05d}.{c_type}.{extension}"
-                else:
-                    extension = self.get_extension(data)
-                    fname = f"{i:05d}.{extension}"
-                
-                final_path = dat_bin_path / extension.upper()
-                final_path.mkdir(exist_ok=True)
-        
-                with open(final_path / fname, "wb") as output:
-                    output.write(data)
+        for extension in self.DAT_EXTENSIONS:
+            folder = dat_bin_path / extension.upper()
+            if not any(folder.iterdir()):
+                folder.rmdir()
+
+        # Compression, type and hashes of each entry so the packing
+        # doesn't need to sniff the files again
+        with open(dat_bin_path / "manifest.json", "w", encoding="utf-8") as f:
+            f.write(json.dumps({"entries": manifest}))
 
 
     def get_style_pointers(self, file: FileIO, ptr_range: tuple[int, int], base_offset: int, style: str) -> tuple[list[int], list[int]]:
@@ -742,7 +837,7 @@ class ToolsTOR(ToolsTales):
                         root = etree.fromstring(xmlFile.read(), parser=etree.XMLParser(recover=True))
 
 
-                    with FileIO(pak[f_index].data, "rb") as f:
+                    with FileIO(pak[f_index].data, "r+b") as f:
                         self.pack_menu_file(root, pools, base_offset, f)
                         
                         f.seek(0)
@@ -750,7 +845,7 @@ class ToolsTOR(ToolsTales):
 
                 (out_path / file_last).parent.mkdir(parents=True, exist_ok=True)
                 with open(out_path / file_last, "wb") as f:
-                    f.write(pak.to_bytes(entry["pak_type"]))
+                    pak.write_to(f, entry["pak_type"])
 
             else:
                 base_offset = entry["base_offset"]
@@ -773,6 +868,8 @@ class ToolsTOR(ToolsTales):
 
 
     def pack_menu_file(self, root, pools: list[list[int]], base_offset: int, f: FileIO) -> None:
+        # Texts and pointers are written in one pass at the end
+        f.start_journal(check_conflicts=True)
         for line in root.iter("Entry"):
             hi = []
             lo = []
@@ -790,13 +887,12 @@ class ToolsTOR(ToolsTales):
             mlen = line.find("MaxLength")
             if mlen is not None:
                 max_len = int(mlen.text)
-                f.seek(flat_ptrs[0])
                 text_bytes = self.get_node_bytes(line) + b"\x00"
                 if len(text_bytes) > max_len:
                     tqdm.write(f"Line id {line.find('Id').text} ({line.find('JapaneseText').text}) too long, truncating...")
-                    f.write(text_bytes[:max_len-1] + b"\x00")
+                    f.write_at(flat_ptrs[0], text_bytes[:max_len-1] + b"\x00")
                 else:
-                    f.write(text_bytes + (b"\x00" * (max_len-len(text_bytes))))
+                    f.write_at(flat_ptrs[0], text_bytes + (b"\x00" * (max_len-len(text_bytes))))
                 continue
             
             text_bytes = self.get_node_bytes(line) + b"\x00"
@@ -810,8 +906,7 @@ class ToolsTOR(ToolsTales):
             else:
                 raise ValueError("Ran out of space")
             
-            f.seek(str_pos)
-            f.write(text_bytes)
+            f.write_at(str_pos, text_bytes)
             virt_pos = str_pos + base_offset
             for off in flat_ptrs:
                 f.write_uint32_at(off, virt_pos)
@@ -826,6 +921,10 @@ class ToolsTOR(ToolsTales):
                 f.write_uint16_at(_h, val_hi)
                 f.write_uint16_at(_l, val_lo)
 
+        journal = f.stop_journal()
+        for pos, size in journal.conflicts:
+            tqdm.write(f"{root.find('Strings').find('Section').text}: 0x{pos:X} ({size} bytes) written by more than one entry")
+
 
     def patch_binaries(self):
         subprocess.run(
@@ -857,22 +956,12 @@ class ToolsTOR(ToolsTales):
    
         print("Packing DAT.BIN files...")
         output_dat_path = self.paths["final_files"] / "DAT.BIN"
-        original_files = self.paths["extracted_files"] / "DAT"
         total_files = (self.POINTERS_END - self.POINTERS_BEGIN) // 4
     
-            
-        # Get all original DAT.BIN files
-        file_list: dict[int, Path] = {}
-        for file in original_files.glob("*/*"):
-            file_index = int(file.name[:5])
-            file_list[file_index] = file
-
-        # Overlay whatever we have compiled
-        # file_list: dict[int, Path] = {}
-        for file in (self.paths["temp_files"] / "DAT").glob("*/*"):
-            file_index = int(file.name[:5])
-            file_list[file_index] = file
+        file_list = self.get_dat_file_list()
                 
+        # Compressed files are written right away, reuse the same buffer
+        scratch = bytearray()
         with open(output_dat_path, "wb") as output_dat:
             for i in tqdm(range(total_files)):
                 file = file_list.get(i)
@@ -885,10 +974,11 @@ class ToolsTOR(ToolsTales):
                 
                 comp_type = re.search(self.VALID_FILE_NAME, file.name).group(2)
                 if comp_type != None:
-                    data = comptolib.compress_data(data, version=int(comp_type))
+                    data = compto_cache.compress_data(data, version=int(comp_type), into=scratch)
             
                 output_dat.write(data)
                 size = len(data)
+                del data  # release the view on the scratch buffer
                 remainder = 0x40 - (size % 0x40)
                 if remainder == 0x40: remainder = 0
                 output_dat.write(b"\x00" * remainder)
@@ -905,44 +995,61 @@ class ToolsTOR(ToolsTales):
         with open(original_slps, "rb") as f:
             slps = f.read()
 
-        with open(patched_slps, "wb") as f:
+        with FileIO(patched_slps, "wb") as f:
             f.write(slps)
             f.seek(self.POINTERS_BEGIN)
-            for sector, remainder in zip(sectors, remainders):
-                f.write(struct.pack("<I", sector + remainder))
+            f.write_array("I", [sector + remainder for sector, remainder in zip(sectors, remainders)])
 
 
-    def _pack_dat_iter(self, sectors: list[int], remainders: list[int]) -> Iterable[bytes]:
-        buffer = 0
+    def get_dat_file_list(self) -> dict[int, Path]:
         original_files = self.paths["extracted_files"] / "DAT"
-        total_files = (self.POINTERS_END - self.POINTERS_BEGIN) // 4
-    
-            
-        # Get all original DAT.BIN files
+
+        # Get all original DAT.BIN files, from the manifest written by
+        # extract_main_archive when there is one
         file_list: dict[int, Path] = {}
-        for file in original_files.glob("*/*"):
-            file_index = int(file.name[:5])
-            file_list[file_index] = file
+        manifest_path = original_files / "manifest.json"
+        if manifest_path.exists():
+            with open(manifest_path, encoding="utf-8") as f:
+                for entry in json.load(f)["entries"]:
+                    file_list[entry["index"]] = original_files / entry["file"]
+        else:
+            for file in original_files.glob("*/*"):
+                file_index = int(file.name[:5])
+                file_list[file_index] = file
 
         # Overlay whatever we have compiled
         for file in (self.paths["temp_files"] / "DAT").glob("*/*"):
             file_index = int(file.name[:5])
             file_list[file_index] = file
-            
-        for i in range(total_files):
-            file = file_list.get(i)
-            if not file:
+
+        return file_list
+
+
+    def _pack_dat_iter(self, sectors: list[int], remainders: list[int], jobs: int = 1, window: int = 0,
+                       start: int = 0, hashes: Optional[dict[int, str]] = None) -> Iterable[bytes]:
+        # sectors already holds the offset of the entry `start`
+        buffer = sectors[-1]
+        total_files = (self.POINTERS_END - self.POINTERS_BEGIN) // 4
+        file_list = self.get_dat_file_list()
+        comp_types = {i: re.search(self.VALID_FILE_NAME, file.name).group(2) for i, file in file_list.items()}
+
+        # The workers compress at most `window` files ahead of the one
+        # being written, the files are always given back in index order
+        executor = None
+        if jobs > 1:
+            executor = ProcessPoolExecutor(max_workers=jobs, initializer=compto_cache.set_default_cache)
+            window = window or jobs * 4
+        pending: deque = deque()
+
+        def emit(i, entry):
+            nonlocal buffer
+            if entry is None:
                 remainders.append(0); sectors.append(buffer)
-                yield b""
-                continue
+                return b""
 
-            with open(file, "rb") as f2:
-                data = f2.read()
-            
-            comp_type = re.search(self.VALID_FILE_NAME, file.name).group(2)
-            if comp_type != None:
-                data = comptolib.compress_data(data, version=int(comp_type))
-        
+            file_hash, data = entry.result() if executor else entry
+            if hashes is not None:
+                hashes[i] = file_hash
             size = len(data)
             remainder = 0x40 - (size % 0x40)
             if remainder == 0x40: remainder = 0
@@ -951,7 +1058,26 @@ class ToolsTOR(ToolsTales):
             buffer += size + remainder
             sectors.append(buffer)
 
-            yield data + (b"\x00" * remainder)
+            return data + (b"\x00" * remainder)
+
+        try:
+            for i in range(start, total_files):
+                file = file_list.get(i)
+                if not file:
+                    pending.append((i, None))
+                elif executor:
+                    pending.append((i, executor.submit(load_dat_file, file, comp_types[i])))
+                else:
+                    pending.append((i, load_dat_file(file, comp_types[i])))
+
+                while len(pending) > window:
+                    yield emit(*pending.popleft())
+
+            while pending:
+                yield emit(*pending.popleft())
+        finally:
+            if executor:
+                executor.shutdown(cancel_futures=True)
 
         
     def pack_all_story(self):
@@ -978,12 +1104,11 @@ class ToolsTOR(ToolsTales):
             pbar.set_description_str(file.name)
             curr_scpk = Scpk.from_path(file)
             old_rsce = Theirsce(curr_scpk.rsce)
-            new_rsce = self.get_new_theirsce(old_rsce, xml_path / file.with_suffix(".xml").name)
-            new_rsce.seek(0)
-            curr_scpk.rsce = new_rsce.read()
+            index = self.get_string_index(file, old_rsce)
+            curr_scpk.rsce = self.get_new_theirsce(old_rsce, xml_path / file.with_suffix(".xml").name, index)
             
             with open(out_path / file.name, "wb") as f:
-                f.write(curr_scpk.to_bytes())
+                curr_scpk.write_to(f)
 
             
     def insert_All(self):
@@ -1007,15 +1132,25 @@ class ToolsTOR(ToolsTales):
         for dirname, _, filelist in iso.walk(iso_path="/"):
             files += [dirname + x for x in filelist]
                 
-        for file in files:   
-            out_path = extract_to / file[1:]   
-            out_path.parent.mkdir(parents=True, exist_ok=True)
-            
-            with iso.open_file_from_iso(iso_path=file) as f, open(str(out_path).split(";")[0], "wb+") as output:
-                with tqdm(total=f.length(), desc=f"Extracting {file[1:].split(';')[0]}", unit="B", unit_divisor=1024, unit_scale=True) as pbar:
-                    while data := f.read(0x8000):
-                        output.write(data)
-                        pbar.update(len(data))
+        with open(game_iso, "rb") as raw_iso:
+            for file in files:   
+                out_path = extract_to / file[1:]   
+                out_path.parent.mkdir(parents=True, exist_ok=True)
+                desc = f"Extracting {file[1:].split(';')[0]}"
+
+                # Files in one extent are copied straight from the iso
+                record = iso.get_record(iso_path=file)
+                if not record.file_flags & (1 << record.FILE_FLAG_MULTI_EXTENT_BIT) and record.data_continuation is None:
+                    with open(str(out_path).split(";")[0], "wb+") as output:
+                        raw_iso.seek(record.extent_location() * 0x800)
+                        copy_stream(raw_iso, output, record.get_data_length(), desc=desc)
+                    continue
+                
+                with iso.open_file_from_iso(iso_path=file) as f, open(str(out_path).split(";")[0], "wb+") as output:
+                    with tqdm(total=f.length(), desc=desc, unit="B", unit_divisor=1024, unit_scale=True) as pbar:
+                        while data := f.read(0x8000):
+                            output.write(data)
+                            pbar.update(len(data))
 
         iso.close()
 
@@ -1027,7 +1162,7 @@ class ToolsTOR(ToolsTales):
             g.write(f.read(0x800))
     
 
-    def make_iso(self) -> None:  
+    def make_iso(self, jobs: int = 1) -> None:  
 
         print("Creating new iso...")
 
@@ -1048,9 +1183,7 @@ class ToolsTOR(ToolsTales):
 
             # 1st place the logo + iso data from the .ims file
             with open(self.paths["original_files"] / "_header.ims", "rb") as f:
-                for _ in tqdm(range(273), desc=f"Copying iso header"):
-                    new.write(f.read(0x800))
-                anchor_save = f.read(0x800)
+                copy_stream(f, new.f, 273 * 0x800, desc=f"Copying iso header")
 
 
             # place the file data in
@@ -1064,67 +1197,210 @@ class ToolsTOR(ToolsTales):
 
             for file in files:
                 with open(file, "rb") as f:
-                    f.seek(0, 2)
-                    size = f.tell()
-                    f.seek(0)
-                    with tqdm(total=size, desc=f"Inserting {file.name}", unit="B", unit_divisor=1024, unit_scale=True) as pbar:
-                        while data := f.read(0x8000):
-                            new.write(data)
-                            pbar.update(len(data))
+                    copy_stream(f, new.f, os.fstat(f.fileno()).st_size, desc=f"Inserting {file.name}")
                 new.write_padding(0x800)
 
             
             # Now we plop the new DAT.BIN in its legitimate spot
+            dat_offset = new.tell()
             sectors: list[int] = [0]
             remainders: list[int] = []
+            hashes: dict[int, str] = {}
             total = (self.POINTERS_END - self.POINTERS_BEGIN) // 4
-            dat_sz = 0
-            for blob in tqdm(self._pack_dat_iter(sectors, remainders), total=total, desc=f"Inserting DAT.BIN"):
+            for blob in tqdm(self._pack_dat_iter(sectors, remainders, jobs, hashes=hashes), total=total, desc=f"Inserting DAT.BIN"):
                 new.write(blob)
-                dat_sz += len(blob)
-            
-            # Align to nearest LBA
-            new.write_padding(0x800)
-            # get FIELD.BIN LBA
-            fld_lba = new.tell() // 0x800
-
-            # Now we plop FIELD.BIN in its legitimate spot
-            with open(self.paths["original_files"] / "FLD.BIN", "rb") as dt:
-                dt.seek(0, 2)
-                fld_sz = dt.tell()
-                dt.seek(0)
-                with tqdm(total=fld_sz, desc=f"Inserting FLD.BIN", unit="B", unit_divisor=1024, unit_scale=True) as pbar:
-                    while data := dt.read(0x8000):
-                        new.write(data)
-                        pbar.update(len(data))
-            
-            # Align file and add the 20MiB pad cdvdgen adds
-            new.write_padding(0x8000); new.write(b"\x00" * 0x13F_F800)
-
-            # get end of volume spot
-            end = new.tell()
-            end_lba = end // 0x800
-
-            # Put the Anchor in place
-            new.write(anchor_save)
-
-            # Now we update the file entries, DAT.BIN only need updated
-            # size, FLD.BIN size and LBA, also update the PVD size
-            new.write_int32_at(0x82992, dat_sz)
-            new.write_int32_at(0x829C2, fld_lba)
-            new.write_int32_at(0x8050, end_lba)
-            new.write_int32_at(end + 0xC, end_lba)
-            new.set_endian("big")
-            new.write_int32_at(0x82996, dat_sz)
-            new.write_int32_at(0x829C6, fld_lba)
-            new.write_int32_at(0x8054, end_lba)
-            new.set_endian("little")
-
-            # Finally, the SLPS, it's at the same location and size
-            # so no problems for us
-            new.seek((274 * 0x800) + self.POINTERS_BEGIN)
-            for sector, remainder in zip(tqdm(sectors, desc="Updating SLPS offsets"), remainders):
-                new.write(struct.pack("<I", sector + remainder))
+
+            self._write_iso_tail(new, sectors, remainders)
+
+        self.save_iso_manifest(new_iso, dat_offset, sectors, remainders, hashes)
+
+
+    def _write_iso_tail(self, new: FileIO, sectors: list[int], remainders: list[int]) -> None:
+        dat_sz = sectors[-1]
+
+        # Align to nearest LBA
+        new.write_padding(0x800)
+        # get FIELD.BIN LBA
+        fld_lba = new.tell() // 0x800
+
+        # Now we plop FIELD.BIN in its legitimate spot
+        with open(self.paths["original_files"] / "FLD.BIN", "rb") as dt:
+            copy_stream(dt, new.f, os.fstat(dt.fileno()).st_size, desc=f"Inserting FLD.BIN")
+        
+        # Align file and add the 20MiB pad cdvdgen adds
+        new.write_padding(0x8000); write_zeros(new.f, 0x13F_F800)
+
+        # get end of volume spot
+        end = new.tell()
+        end_lba = end // 0x800
+
+        # Put the Anchor in place, it's right after the header in the .ims
+        with open(self.paths["original_files"] / "_header.ims", "rb") as f:
+            f.seek(273 * 0x800)
+            new.write(f.read(0x800))
+        new.truncate()
+
+        # Now we update the file entries, DAT.BIN only need updated
+        # size, FLD.BIN size and LBA, also update the PVD size
+        new.write_int32_at(0x82992, dat_sz)
+        new.write_int32_at(0x829C2, fld_lba)
+        new.write_int32_at(0x8050, end_lba)
+        new.write_int32_at(end + 0xC, end_lba)
+        new.set_endian("big")
+        new.write_int32_at(0x82996, dat_sz)
+        new.write_int32_at(0x829C6, fld_lba)
+        new.write_int32_at(0x8054, end_lba)
+        new.set_endian("little")
+
+        self._write_dat_pointers(new, sectors, remainders)
+
+
+    def _write_dat_pointers(self, new: FileIO, sectors: list[int], remainders: list[int]) -> None:
+        # Finally, the SLPS, it's at the same location and size
+        # so no problems for us
+        new.write_array_at((274 * 0x800) + self.POINTERS_BEGIN, "I",
+                           [sector + remainder for sector, remainder in zip(sectors, remainders)])
+
+
+    def save_iso_manifest(self, iso_path: Path, dat_offset: int, sectors: list[int], remainders: list[int], hashes: dict[int, str]) -> None:
+        # Offset, size and source of every DAT.BIN entry of the build
+        # used by make_iso_incremental to only patch what changed
+        file_list = self.get_dat_file_list()
+        entries = []
+        for i, remainder in enumerate(remainders):
+            file = file_list.get(i)
+            stat = file.stat() if file else None
+            entries.append({
+                "file": str(file) if file else None,
+                "mtime": stat.st_mtime_ns if stat else 0,
+                "file_size": stat.st_size if stat else 0,
+                "hash": hashes.get(i),
+                "offset": sectors[i],
+                "size": sectors[i + 1] - sectors[i] - remainder,
+                "remainder": remainder,
+            })
+
+        manifest = {
+            "iso": iso_path.name,
+            "iso_size": iso_path.stat().st_size,
+            "slps_size": (self.paths["temp_files"] / self.main_exe_name).stat().st_size,
+            "dat_offset": dat_offset,
+            "dat_size": sectors[-1],
+            "entries": entries,
+        }
+        with open(self.paths["game_builds"] / "dat_manifest.json", "w", encoding="utf-8") as f:
+            f.write(json.dumps(manifest))
+
+
+    def load_iso_manifest(self) -> Optional[dict]:
+        manifest_path = self.paths["game_builds"] / "dat_manifest.json"
+        if not manifest_path.exists():
+            return None
+
+        with open(manifest_path, encoding="utf-8") as f:
+            manifest = json.load(f)
+
+        # The build needs to be the one of the manifest, untouched
+        iso_path = self.paths["game_builds"] / manifest["iso"]
+        slps_path = self.paths["temp_files"] / self.main_exe_name
+        total = (self.POINTERS_END - self.POINTERS_BEGIN) // 4
+        if not iso_path.exists() or iso_path.stat().st_size != manifest["iso_size"]:
+            return None
+        if slps_path.stat().st_size != manifest["slps_size"] or len(manifest["entries"]) != total:
+            return None
+        return manifest
+
+
+    def is_same_dat_entry(self, file: Optional[Path], entry: dict) -> bool:
+        if file is None or entry["file"] != str(file):
+            return file is None and entry["file"] is None
+
+        stat = file.stat()
+        if (stat.st_mtime_ns, stat.st_size) == (entry["mtime"], entry["file_size"]):
+            return True
+        with open(file, "rb") as f:
+            return hashlib.sha1(f.read()).hexdigest() == entry["hash"]
+
+
+    def make_iso_incremental(self, jobs: int = 1) -> None:
+        manifest = self.load_iso_manifest()
+        if manifest is None:
+            print("No usable previous build, creating a full iso...")
+            self.make_iso(jobs)
+            return
+
+        iso_path = self.paths["game_builds"] / manifest["iso"]
+        print(f"Patching {iso_path.name}...")
+
+        entries = manifest["entries"]
+        dat_offset = manifest["dat_offset"]
+        sectors: list[int] = [entry["offset"] for entry in entries] + [manifest["dat_size"]]
+        remainders: list[int] = [entry["remainder"] for entry in entries]
+        hashes: dict[int, str] = {i: entry["hash"] for i, entry in enumerate(entries) if entry["hash"]}
+        total = len(entries)
+
+        # Find the entries that changed since the previous build
+        file_list = self.get_dat_file_list()
+        changed = [i for i in tqdm(range(total), desc="Looking for changes") if not self.is_same_dat_entry(file_list.get(i), entries[i])]
+        changed_files = [file_list.get(i) for i in changed]
+        comp_types = [re.search(self.VALID_FILE_NAME, file.name).group(2) if file else None for file in changed_files]
+
+        # Changed entries are patched in place while they keep the same
+        # 0x40 aligned slot, the size can't be expressed otherwise
+        # From the first one that doesn't, the rest of the DAT.BIN is moved
+        patches = []
+        relocate_from = None
+        executor = None
+        if jobs > 1 and len(changed) > 1:
+            executor = ProcessPoolExecutor(max_workers=jobs, initializer=compto_cache.set_default_cache)
+            results = executor.map(load_dat_file, changed_files, comp_types)
+        else:
+            results = map(load_dat_file, changed_files, comp_types)
+
+        try:
+            for i, (file_hash, data) in zip(changed, results):
+                size = len(data)
+                remainder = 0x40 - (size % 0x40)
+                if remainder == 0x40: remainder = 0
+
+                if size + remainder != sectors[i + 1] - sectors[i]:
+                    relocate_from = i
+                    break
+                patches.append((i, data, remainder, file_hash))
+        finally:
+            if executor:
+                executor.shutdown(cancel_futures=True)
+
+        with FileIO(iso_path, "r+b") as iso:
+
+            # The SLPS is always written back, it has the same size
+            with open(self.paths["temp_files"] / self.main_exe_name, "rb") as f:
+                iso.seek(274 * 0x800)
+                iso.write(f.read())
+
+            for i, data, remainder, file_hash in tqdm(patches, desc="Patching DAT.BIN"):
+                iso.seek(dat_offset + sectors[i])
+                iso.write(data + (b"\x00" * remainder))
+                remainders[i] = remainder
+                hashes.pop(i, None)
+                if file_hash:
+                    hashes[i] = file_hash
+
+            if relocate_from is None:
+                self._write_dat_pointers(iso, sectors, remainders)
+            else:
+                del sectors[relocate_from + 1:]
+                del remainders[relocate_from:]
+                for i in range(relocate_from, total):
+                    hashes.pop(i, None)
+                iso.seek(dat_offset + sectors[relocate_from])
+                for blob in tqdm(self._pack_dat_iter(sectors, remainders, jobs, start=relocate_from, hashes=hashes),
+                                 total=total - relocate_from, desc=f"Moving DAT.BIN from entry {relocate_from}"):
+                    iso.write(blob)
+
+                self._write_iso_tail(iso, sectors, remainders)
+
+        self.save_iso_manifest(iso_path, dat_offset, sectors, remainders, hashes)
 
 
     def clean_folder(self, path: Path) -> None:
@@ -297,9 +297,10 @@ class ToolsTales:
                     
         return pointers_offset, texts_offset
     
-    def get_extension(self, data) -> str:
-        if data[:4] in self.MAGIC_CHECK:
-            return self.MAGIC_CHECK[data[:4]]
+    @classmethod
+    def get_extension(cls, data) -> str:
+        if data[:4] in cls.MAGIC_CHECK:
+            return cls.MAGIC_CHECK[data[:4]]
         
         if data[:8] == b"IECSsreV":
             if data[0x50:0x58] == b"IECSigaV":
@@ -319,7 +320,7 @@ class ToolsTales:
         if data[6:8] == b"\xBD\x27":
             return "ovl"
     
-        is_pak = self.get_pak_type(data)
+        is_pak = cls.get_pak_type(data)
         if is_pak != None:
             return is_pak
         
@@ -331,7 +332,8 @@ class ToolsTales:
         # Didn't match anything
         return "bin"
     
-    def get_pak_type(self,data) -> Union[str, None]:
+    @staticmethod
+    def get_pak_type(data) -> Union[str, None]:
         is_aligned = False
         
         data_size = len(data)
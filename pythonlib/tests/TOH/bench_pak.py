@@ -0,0 +1,55 @@
+# Benchmark of the PAK3 serializer against the old bytes concatenation
+# Run from the repository root: python -m pythonlib.tests.TOH.bench_pak
+import io
+import struct
+import timeit
+
+from pythonlib.formats.pak import Pak, pak_file
+
+
+def make_pak(file_amount: int, file_size: int) -> Pak:
+    pak = Pak()
+    pak.type = 3
+    pak.align = True
+    pak.files = [pak_file(False, 0, bytes([i & 0xFF]) * file_size) for i in range(file_amount)]
+    return pak
+
+
+def run_legacy(pak: Pak) -> bytes:
+    blobs = [blob.data for blob in pak.files]
+    out = struct.pack("<I", len(blobs))
+    offset = 4 + (4 * len(blobs))
+    offset = offset + (0x10 - (offset % 0x10))
+
+    cur = offset
+    for blob in blobs:
+        out += struct.pack("<I", cur)
+        cur += len(blob)
+        cur += (0x10 - (cur % 0x10))
+
+    for blob in blobs:
+        out += b"\x00" * (0x10 - (len(out) % 0x10))
+        out += blob
+    return out
+
+
+def run_stream(pak: Pak) -> bytes:
+    f = io.BytesIO()
+    pak.write_to(f)
+    return f.getvalue()
+
+
+def main(number=3, file_size=0x800):
+    for file_amount in (250, 500, 1000, 2000, 4000):
+        pak = make_pak(file_amount, file_size)
+        assert run_legacy(pak) == pak.to_bytes() == run_stream(pak), f'Mismatch with {file_amount} files'
+
+        legacy = timeit.timeit(lambda: run_legacy(pak), number=number) / number
+        linear = timeit.timeit(lambda: pak.to_bytes(), number=number) / number
+        stream = timeit.timeit(lambda: run_stream(pak), number=number) / number
+        print(f'{file_amount:>5} files {file_amount * file_size / 0x100000:6.1f} MiB  legacy: {legacy * 1000:8.2f} ms  '
+              f'to_bytes: {linear * 1000:7.2f} ms  write_to: {stream * 1000:7.2f} ms  x{legacy / linear:.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+# Micro-benchmark of the TOH text decoders over the SCP test files
+# Run from the repository root: python -m pythonlib.tests.TOH.bench_text_toh
+import struct
+import timeit
+from pathlib import Path
+
+from pythonlib.formats.FileIO import FileIO
+from pythonlib.formats.text_toh import bytes_to_text, get_codec
+
+base_path = Path('pythonlib/tests/TOH/files')
+
+
+def string_offsets(data: bytes) -> list[int]:
+    decoder = get_codec().decoder
+    offsets = []
+    pos = struct.unpack_from('<I', data, 0xC)[0]
+    while pos < len(data) - 1:
+        # Stop at the first block that isn't text
+        try:
+            _, _, end = decoder.decode(data, pos)
+        except (UnicodeDecodeError, IndexError):
+            break
+        offsets.append(pos)
+        pos = end
+    return offsets
+
+
+def run_legacy(path: Path, offsets: list[int]):
+    with FileIO(path, 'rb') as f:
+        return [bytes_to_text(f, offset) for offset in offsets]
+
+
+def run_tables(data: bytes, offsets: list[int]):
+    decoder = get_codec().decoder
+    view = memoryview(data)
+    return [decoder.decode(view, offset)[:2] for offset in offsets]
+
+
+def main(number=5):
+    total_legacy = 0
+    total_tables = 0
+    for path in sorted(base_path.glob('*.SCP')):
+        data = path.read_bytes()
+        offsets = string_offsets(data)
+        assert run_legacy(path, offsets) == run_tables(data, offsets), f'Mismatch in {path.name}'
+
+        legacy = timeit.timeit(lambda: run_legacy(path, offsets), number=number) / number
+        tables = timeit.timeit(lambda: run_tables(data, offsets), number=number) / number
+        total_legacy += legacy
+        total_tables += tables
+        print(f'{path.name:<12} {len(offsets):>5} strings  legacy: {legacy * 1000:8.2f} ms  '
+              f'tables: {tables * 1000:8.2f} ms  x{legacy / tables:.1f}')
+
+    print(f'{"Total":<12} {"":>13}  legacy: {total_legacy * 1000:8.2f} ms  '
+          f'tables: {total_tables * 1000:8.2f} ms  x{total_legacy / total_tables:.1f}')
+
+
+if __name__ == '__main__':
+    main()
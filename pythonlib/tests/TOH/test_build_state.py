@@ -0,0 +1,28 @@
+from pythonlib.utils.build_state import BuildState
+
+def test_dirty_nodes(tmp_path):
+    xml_path = tmp_path / 'TEST.xml'
+    out_path = tmp_path / 'TEST.SCP'
+    xml_path.write_text('<SceneText/>')
+    out_path.write_bytes(b'TSS')
+
+    state = BuildState(tmp_path / 'build_state.json')
+    inputs = state.hash_files([xml_path])
+    assert state.is_dirty('TEST.SCP', inputs)
+    state.set_node('TEST.SCP', inputs, [out_path])
+    state.save()
+
+    #Same inputs and outputs after reloading
+    state = BuildState(tmp_path / 'build_state.json')
+    assert not state.is_dirty('TEST.SCP', state.hash_files([xml_path]))
+    assert state.get_outputs(*state.find_nodes('TEST', '.SCP')) == {str(out_path): state.hash_file(out_path)}
+
+    #Edited input
+    xml_path.write_text('<SceneText></SceneText>')
+    assert state.is_dirty('TEST.SCP', state.hash_files([xml_path]))
+
+    #Removed output
+    inputs = state.hash_files([xml_path])
+    state.set_node('TEST.SCP', inputs, [out_path])
+    out_path.unlink()
+    assert state.is_dirty('TEST.SCP', inputs)
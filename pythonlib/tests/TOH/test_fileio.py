@@ -0,0 +1,81 @@
+import struct
+from io import BytesIO
+from pythonlib.formats.FileIO import FileIO
+
+def test_arrays_both_endians():
+    values = [0, 1, 0x1234, 0xFFFFFFFF]
+    for endian in ('<', '>'):
+        data = BytesIO()
+        with FileIO(data, endian=endian) as f:
+            f.write_uint16(0xABCD)
+            f.write_array('I', values)
+            assert data.getvalue()[2:] == struct.pack(f'{endian}4I', *values)
+
+            #Same values as the scalar reads
+            assert f.read_array_at(2, 'I', 4).tolist() == [f.read_uint32_at(2 + 4 * i) for i in range(4)]
+            assert f.read_array_at(2, 'L', 4, numpy=True).tolist() == values
+            assert f.tell() == 18
+
+def test_read_struct():
+    with FileIO(struct.pack('>HI', 1, 2) + b'name') as f:
+        f.set_endian('big')
+        assert f.read_struct('HI') == (1, 2)
+        assert f.read_struct(struct.Struct('4s')) == (b'name',)
+        assert f.get_struct('HI') is f.get_struct('HI')
+
+def test_view_modes(tmp_path):
+    data = struct.pack('<4I', 1, 2, 3, 4) + b'text\x00'
+    (tmp_path / 'test.bin').write_bytes(data)
+
+    for source, kwargs in ((data, {}), (tmp_path / 'test.bin', {'use_mmap': True})):
+        with FileIO(source, 'rb', **kwargs) as f:
+            assert f.is_view_mode()
+            assert f.read_uint32_at(4) == 2
+            assert f.read_array('I', 4).tolist() == [1, 2, 3, 4]
+            view = f.read_view(4)
+            assert isinstance(view, memoryview) and view == b'text'
+            assert f.read_at(0, 4) == data[:4] and f.tell() == 20
+            assert f.read() == b'\x00'
+
+    #Small files and writable files are read as before
+    with FileIO(tmp_path / 'test.bin', 'rb') as f:
+        assert not f.is_view_mode()
+    with FileIO(data) as f:
+        assert not f.is_view_mode()
+
+def test_at_methods_keep_position(tmp_path):
+    (tmp_path / 'test.bin').write_bytes(bytes(16))
+    for source in (tmp_path / 'test.bin', BytesIO(bytes(16))):
+        with FileIO(source) as f:
+            f.seek(3)
+            f.write(b'\x01')
+            f.write_uint32_at(8, 0x11223344)
+            f.write_uint16_at(14, 0x5566)
+            assert f.tell() == 4
+            assert f.read_uint32_at(8) == 0x11223344 and f.read_at(3, 1) == b'\x01'
+            assert f.read(4) == bytes(4) and f.read(4) == bytes.fromhex('44332211')
+
+            #Past the end the file grows like with write
+            f.write_at(18, b'end')
+            f.seek(0)
+            assert f.read() == b'\x00\x00\x00\x01' + bytes(4) + bytes.fromhex('44332211') + b'\x00\x00\x66\x55\x00\x00end'
+
+def test_patch_journal(tmp_path):
+    (tmp_path / 'test.bin').write_bytes(bytes(32))
+    with FileIO(tmp_path / 'test.bin') as f:
+        journal = f.start_journal(check_conflicts=True)
+        f.write_at(4, b'text\x00')
+        f.write_uint32_at(16, 4)
+        f.write_uint32_at(20, 4)
+        f.write_uint16_at(9, 0)
+
+        #Nothing written before the journal is applied
+        assert f.read_at(4, 4) == bytes(4)
+
+        #Same pointer written by a second entry
+        f.write_uint32_at(16, 9)
+
+    assert (tmp_path / 'test.bin').read_bytes() == bytes(4) + b'text' + bytes(8) + struct.pack('<2I', 9, 4) + bytes(8)
+    assert journal.conflicts == [(16, 4)]
+    assert journal.stats['writes'] == 5 and journal.stats['ranges'] == 2
+    assert journal.stats['bytes'] == 19 and journal.stats['bytes_written'] == 15
@@ -0,0 +1,52 @@
+from pathlib import Path
+import struct
+import pytest
+from pythonlib.formats.fps4 import Fps4
+from pythonlib.utils import nds_lz
+
+base_path = Path(__file__).parent / 'files'
+scp_files = ['LITD04P.SCP', 'VOLD01P.SCP', 'STRT00.SCP']
+
+@pytest.fixture
+def fps4_paths(tmp_path):
+    #Type 1 archive with LZ10 members, the table is in the .b
+    header = bytearray(b'FPS4' + struct.pack('<3L', len(scp_files) + 1, 0x1C, 0) + struct.pack('<H', 0x2C))
+    header += b'\x00' * (0x1C - len(header))
+    detail = bytearray()
+    for name in scp_files:
+        data = nds_lz.compress_lz10((base_path / name).read_bytes())
+        header += struct.pack('<3L', len(detail), len(data), len(data)) + name.encode().ljust(32, b'\x00')
+        detail += data
+    header += struct.pack('<L', len(detail)) + b'\x00' * 12
+
+    (tmp_path / 'test.b').write_bytes(header)
+    (tmp_path / 'test.dat').write_bytes(detail)
+    return tmp_path / 'test.b', tmp_path / 'test.dat'
+
+def test_lazy_same_table(fps4_paths):
+    header_path, detail_path = fps4_paths
+    fps4 = Fps4(header_path=header_path, detail_path=detail_path)
+    fps4_lazy = Fps4(header_path=header_path, detail_path=detail_path, lazy=True)
+
+    for file, file_lazy in zip(fps4.files, fps4_lazy.files):
+        assert isinstance(file_lazy.data, memoryview)
+        assert (file.name, file.offset, file.size, file.c_type) == (file_lazy.name, file_lazy.offset, file_lazy.size, file_lazy.c_type)
+        assert file.data == file_lazy.data
+
+    assert nds_lz.decompress(fps4_lazy.get_file('VOLD01P.SCP').data) == (base_path / 'VOLD01P.SCP').read_bytes()
+    fps4_lazy.close()
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_extract_pack(fps4_paths, tmp_path, jobs):
+    header_path, detail_path = fps4_paths
+    fps4 = Fps4(header_path=header_path, detail_path=detail_path, lazy=True)
+    fps4.extract_files(tmp_path / 'extracted', tmp_path / 'updated', decompressed=True, jobs=jobs)
+    for name in scp_files:
+        assert (tmp_path / 'extracted' / name).read_bytes() == (base_path / name).read_bytes()
+
+    #Repacking without changes gives back the same archive
+    (tmp_path / 'final').mkdir()
+    fps4.pack_fps4_type1(tmp_path / 'updated', tmp_path / 'final', jobs=jobs)
+    fps4.close()
+    assert (tmp_path / 'final' / 'test.dat').read_bytes() == detail_path.read_bytes()
+    assert (tmp_path / 'final' / 'test.b').read_bytes() == header_path.read_bytes()
@@ -0,0 +1,30 @@
+from pathlib import Path
+import pytest
+from pythonlib.utils import nds_lz
+
+base_path = Path(__file__).parent / 'files'
+sample = b'TSS\x00' + b'abc' * 4 + b'\x00' * 8 + b'a' * 252
+
+#Outputs of lzss -evn and lzx -evb
+def test_lz10_same_as_lzss():
+    expected = bytes.fromhex('101401000154535300616263600227000030016161f001f013f025fff037f049f05bf06df07ff091f0a3f0b5e0f0c7f0d9d0eb')
+    assert nds_lz.compress_lz10(sample) == expected
+
+def test_lz11_same_as_lzx():
+    expected = bytes.fromhex('1114010001545353006162638002240000500161610e9001')
+    assert nds_lz.compress_lz11(sample) == expected
+
+@pytest.mark.parametrize("data", [b'', b'a', b'aa', b'aaa', b'abababab', bytes(range(256)) * 20, b'\x00' * 70000])
+def test_roundtrip_small(data):
+    assert nds_lz.decompress(nds_lz.compress_lz10(data)) == data
+    assert nds_lz.decompress(nds_lz.compress_lz11(data)) == data
+
+@pytest.mark.parametrize("file_name", ['LITD04P.SCP', 'VOLD01P.SCP'])
+def test_roundtrip_scp(file_name):
+    data = (base_path / file_name).read_bytes()
+    assert nds_lz.decompress(nds_lz.compress(data, 'LZ10')) == data
+    assert nds_lz.decompress(nds_lz.compress(data, 'LZ11')) == data
+
+def test_decompress_bad_header():
+    with pytest.raises(ValueError):
+        nds_lz.decompress(b'\x00\x04\x00\x00abcd')
@@ -2,7 +2,7 @@ import os
 from pathlib import Path
 from pythonlib.games import ToolsTOH
 from pythonlib.formats.FileIO import FileIO
-from pythonlib.formats.text_toh import bytes_to_text, text_to_bytes
+from pythonlib.formats.text_toh import bytes_to_text, text_to_bytes, get_codec
 import pytest
 import pyjson5 as json
 import pdb
@@ -66,6 +66,34 @@ def test_voiceid_to_text(config_bytes, n):
         assert buffer == input_bytes
 
 
+@pytest.mark.parametrize("n", [0,1,2,3,4,5,6,7,8,9,10,11,12,13,14])
+def test_decoder_to_text(config_bytes, n):
+    input_bytes = bytes.fromhex(config_bytes[n]['byte'].replace(' ', ''))
+    res, buffer, end = get_codec().decoder.decode(memoryview(input_bytes + b'\x00'), 0)
+    assert res == config_bytes[n]['text']
+    assert buffer == input_bytes
+    assert end == len(input_bytes) + 1
+
+
+@pytest.mark.parametrize("file_name", ['AMUT01P.SCP', 'FSHT00.SCP', 'LITD04P.SCP', 'VOLD01P.SCP'])
+def test_decoder_scp_strings(file_name):
+    path = base_path / 'files' / file_name
+    data = path.read_bytes()
+
+    with FileIO(path, 'rb') as f:
+        f.seek(0xC)
+        pos = f.read_uint32()
+        while pos < len(data) - 1:
+            # Stop at the first block that isn't text
+            try:
+                expected = bytes_to_text(f, pos)
+            except (UnicodeDecodeError, TypeError):
+                break
+            res, buffer, pos = get_codec().decoder.decode(data, pos)
+            assert (res, buffer) == expected
+            assert f.tell() == pos
+
+
 @pytest.mark.parametrize("n", [0,1,2])
 def test_colors_to_bytes(config_text, n):
     input = config_text[n]['text']
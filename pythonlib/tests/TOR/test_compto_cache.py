@@ -0,0 +1,72 @@
+import os
+import pytest
+from pythonlib.utils import compto_cache
+from pythonlib.utils.compto_cache import ComptoCache
+
+@pytest.fixture
+def calls(monkeypatch):
+    #Fake compression, the version is the first byte like compto
+    calls = []
+    def compress_data(data, version=3, into=None):
+        calls.append((bytes(data), version))
+        return bytes([version]) + bytes(data)[::-1]
+    monkeypatch.setattr(compto_cache.comptolib, 'compress_data', compress_data)
+    return calls
+
+def test_hit_miss(tmp_path, calls):
+    cache = ComptoCache(tmp_path)
+    assert cache.compress_data(b'abcd', 1) == b'\x01dcba'
+    assert cache.compress_data(b'abcd', 1) == b'\x01dcba'
+    assert cache.hits == 1 and cache.misses == 1 and len(calls) == 1
+
+    #Reused by the next runs, without temp files left
+    cache = ComptoCache(tmp_path)
+    assert cache.compress_data(b'abcd', 1) == b'\x01dcba'
+    assert cache.hits == 1 and len(calls) == 1
+    assert [name for name in os.listdir(cache.folder) if not name.endswith('.bin')] == []
+
+def test_keys(tmp_path, calls):
+    cache = ComptoCache(tmp_path)
+    assert cache.compress_data(b'abcd', 1) == b'\x01dcba'
+    assert cache.compress_data(b'abcd', 3) == b'\x03dcba'
+    assert cache.compress_data(b'abce', 1) == b'\x01ecba'
+    assert cache.compress_data(bytearray(b'abcd'), 3) == b'\x03dcba'
+    assert cache.misses == 3 and cache.hits == 1
+    assert calls == [(b'abcd', 1), (b'abcd', 3), (b'abce', 1)]
+
+    #Removed by another process
+    os.remove(cache.get_path(b'abcd', 1))
+    assert cache.compress_data(b'abcd', 1) == b'\x01dcba'
+    assert cache.misses == 4 and cache.total_size == 3 * 5
+
+def set_mtime(path, time):
+    #Times in the past, 10**17 ns apart
+    os.utime(path, ns=(time * 10**17, time * 10**17))
+
+def test_eviction(tmp_path, calls):
+    #3 entries of 41 bytes go over the cap
+    blobs = [bytes([i]) * 40 for i in range(3)]
+    cache = ComptoCache(tmp_path, max_size=100)
+    cache.compress_data(blobs[0])
+    cache.compress_data(blobs[1])
+
+    #The first one is used last
+    set_mtime(cache.get_path(blobs[0], 3), 2)
+    set_mtime(cache.get_path(blobs[1], 3), 1)
+    cache = ComptoCache(tmp_path, max_size=100)
+    assert cache.total_size == 82
+
+    cache.compress_data(blobs[2])
+    assert cache.total_size == 82 <= 100
+    assert not os.path.exists(cache.get_path(blobs[1], 3))
+    assert os.path.exists(cache.get_path(blobs[0], 3)) and os.path.exists(cache.get_path(blobs[2], 3))
+
+    #A hit makes the entry the newest one
+    set_mtime(cache.get_path(blobs[2], 3), 3)
+    cache = ComptoCache(tmp_path, max_size=100)
+    cache.compress_data(blobs[0])
+    assert os.stat(cache.get_path(blobs[0], 3)).st_mtime_ns > 3 * 10**17
+    cache.compress_data(blobs[1])
+    assert not os.path.exists(cache.get_path(blobs[2], 3))
+    assert os.path.exists(cache.get_path(blobs[0], 3)) and os.path.exists(cache.get_path(blobs[1], 3))
+    assert ComptoCache(tmp_path, max_size=100).total_size == 82
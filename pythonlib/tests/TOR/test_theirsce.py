@@ -0,0 +1,114 @@
+import struct
+import pytest
+from pythonlib.formats.theirsce import Theirsce
+from pythonlib.formats.theirsce_index import StringIndex, encode_string_instruction
+from pythonlib.formats.theirsce_strings import build_string_pool, build_theirsce
+
+def make_theirsce(code: bytes, strings: bytes) -> bytes:
+    #Header, 6 empty sections and the code right after them
+    code_offset = 0x18 + 6 * 2 + 2
+    header = b'THEIRSCE' + struct.pack('<3I2H', code_offset, code_offset + len(code), 0, 0, 0)
+    return header + struct.pack('<6H', *[0x18 + 6 * 2] * 6) + b'\x00\x00' + code + strings
+
+#Strings at 1 and 5, a push and an ALU instruction between them
+sample_code = encode_string_instruction(1) + b'\xC9\x05\x81' + encode_string_instruction(5) + encode_string_instruction(1)
+sample = make_theirsce(sample_code, b'\x00abc\x00de\x00')
+string_pos = [0x26, 0x2C, 0x2F]
+
+def test_index_references():
+    index = StringIndex.from_theirsce(Theirsce(sample))
+    assert index.references == {1: [(0x26, 0xF8), (0x2F, 0xF8)], 5: [(0x2C, 0xF8)]}
+    assert index.get_pointers(1) == [0x27, 0x30]
+    assert all(index.is_pointer(pos + 1) for pos in string_pos)
+    assert not index.is_pointer(0x26) and not index.is_pointer(0x2A)
+
+def test_index_save_load(tmp_path):
+    index = StringIndex.from_theirsce(Theirsce(sample))
+    index.save(tmp_path / 'index' / 'test.tsri')
+
+    loaded = StringIndex.load(tmp_path / 'index' / 'test.tsri', Theirsce(sample))
+    assert loaded.file_hash == index.file_hash
+    assert loaded.references == index.references
+    assert StringIndex.from_bytes(index.to_bytes()).to_bytes() == index.to_bytes()
+
+def test_index_stale(tmp_path):
+    StringIndex.from_theirsce(Theirsce(sample)).save(tmp_path / 'test.tsri')
+
+    #Same size, one string moved
+    edited = make_theirsce(sample_code[:-3] + encode_string_instruction(2), b'\x00abc\x00de\x00')
+    assert StringIndex.load(tmp_path / 'test.tsri', Theirsce(edited)) is None
+
+    #Missing or broken sidecar
+    assert StringIndex.load(tmp_path / 'missing.tsri', Theirsce(sample)) is None
+    (tmp_path / 'broken.tsri').write_bytes(b'TSRI')
+    assert StringIndex.load(tmp_path / 'broken.tsri', Theirsce(sample)) is None
+    (tmp_path / 'other.tsri').write_bytes(b'\x00' * 64)
+    assert StringIndex.load(tmp_path / 'other.tsri', Theirsce(sample)) is None
+
+def test_index_check_patch():
+    index = StringIndex.from_theirsce(Theirsce(sample))
+    data = bytearray(sample)
+
+    index.patch(data, 0x2D, 0x12345)
+    assert data[0x2C:0x2F] == b'\xF9\x45\x23'
+    assert Theirsce(bytes(data)).decode_code().string_offsets.tolist() == [1, 0x12345, 1]
+
+    with pytest.raises(ValueError):
+        index.check(0x2B, 1)
+    with pytest.raises(ValueError):
+        index.patch(data, 0x27, 1 << 18)
+    assert data == bytearray(sample)[:0x2C] + b'\xF9\x45\x23' + sample[0x2F:]
+
+def get_strings(data: bytes) -> dict[int, bytes]:
+    #String of every STRING instruction by the position of its operand
+    theirsce = Theirsce(data)
+    code = theirsce.decode_code()
+    strings = {}
+    for index, offset in zip(code.string_indexes, code.string_offsets):
+        start = theirsce.strings_offset + offset
+        strings[code.positions[index] + 1] = data[start:data.index(b'\x00', start)]
+    return strings
+
+def check_pool(pool, offsets, strings):
+    for string, offset in zip(strings, offsets):
+        assert pool[offset:offset + len(string) + 1] == string + b'\x00'
+
+def test_string_pool_suffixes():
+    strings = [b'abc', b'bc', b'c', b'xbc', b'zz']
+    pool, offsets = build_string_pool(strings)
+    check_pool(pool, offsets, strings)
+
+    #bc and c are stored inside abc or xbc
+    assert len(pool) == 1 + len(b'abc\x00') + len(b'xbc\x00') + len(b'zz\x00')
+    assert offsets[2] == offsets[1] + 1
+
+def test_string_pool_duplicates_empty():
+    strings = [b'aa', b'', b'aa', b'a', b'']
+    pool, offsets = build_string_pool(strings, first=b'\xFF')
+    check_pool(pool, offsets, strings)
+    assert pool == bytearray(b'\xFFaa\x00')
+    assert offsets == [1, 3, 1, 2, 3]
+
+    pool, offsets = build_string_pool([])
+    assert pool == bytearray(b'\x00') and offsets == []
+
+@pytest.mark.parametrize("use_index", [False, True])
+def test_build_theirsce_roundtrip(use_index):
+    index = StringIndex.from_theirsce(Theirsce(sample)) if use_index else None
+    entries = [([0x27], b'hello'), ([0x2D, 0x30], b'lo'), ([], b'unused')]
+    data = build_theirsce(sample, Theirsce(sample).strings_offset, entries, index)
+
+    assert data[:0x26] == sample[:0x26] and data[0x29:0x2C] == sample[0x29:0x2C]
+    assert get_strings(data) == {0x27: b'hello', 0x2D: b'lo', 0x30: b'lo'}
+
+def test_build_theirsce_big_offsets():
+    entries = [([0x27], b'a' * 0x10000), ([0x2D, 0x30], b'end')]
+    strings_offset = Theirsce(sample).strings_offset
+
+    #The 2 high bits need the opcode, only the index can change it
+    with pytest.raises(ValueError):
+        build_theirsce(sample, strings_offset, entries)
+
+    data = build_theirsce(sample, strings_offset, entries, StringIndex.from_theirsce(Theirsce(sample)))
+    assert data[0x2C] == 0xF9 and data[0x2F] == 0xF9
+    assert get_strings(data) == {0x27: b'a' * 0x10000, 0x2D: b'end', 0x30: b'end'}
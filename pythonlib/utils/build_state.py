@@ -0,0 +1,69 @@
+import hashlib
+import os
+from pathlib import Path
+from typing import Optional
+
+import pyjson5 as json
+
+
+class BuildState:
+    # Build graph kept between runs, each node stores the hashes of the inputs
+    # it was made from and of the files it wrote. A node is rebuilt only when
+    # one of them changed, the outputs of a node are the inputs of the next one
+    def __init__(self, path: Path) -> None:
+        self.path = Path(path)
+
+        # The files are only read again when their size or mtime changed
+        self.files: dict[str, list] = {}
+        self.nodes: dict[str, dict] = {}
+        if self.path.exists():
+            with open(self.path, encoding="utf-8") as f:
+                state = json.load(f)
+            self.files = state["files"]
+            self.nodes = state["nodes"]
+
+    def hash_file(self, path: Path) -> Optional[str]:
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+
+        key = str(path)
+        cached = self.files.get(key)
+        if cached is not None and cached[:2] == [stat.st_mtime_ns, stat.st_size]:
+            return cached[2]
+
+        with open(path, "rb") as f:
+            file_hash = hashlib.sha1(f.read()).hexdigest()
+        self.files[key] = [stat.st_mtime_ns, stat.st_size, file_hash]
+        return file_hash
+
+    def hash_files(self, paths: list[Path]) -> dict[str, Optional[str]]:
+        return {str(path): self.hash_file(path) for path in paths}
+
+    def is_dirty(self, node: str, inputs: dict) -> bool:
+        entry = self.nodes.get(node)
+        if entry is None or entry["inputs"] != inputs:
+            return True
+
+        # The outputs were removed or edited by hand
+        return any(self.hash_file(Path(path)) != file_hash for path, file_hash in entry["outputs"].items())
+
+    def find_nodes(self, prefix: str, suffix: str = "") -> list[str]:
+        return sorted(node for node in self.nodes if node.startswith(prefix) and node.endswith(suffix))
+
+    def get_outputs(self, *nodes: str) -> dict[str, Optional[str]]:
+        outputs = {}
+        for node in nodes:
+            if node in self.nodes:
+                outputs.update(self.nodes[node]["outputs"])
+        return outputs
+
+    def set_node(self, node: str, inputs: dict, outputs: list[Path]) -> None:
+        self.nodes[node] = {"inputs": inputs, "outputs": self.hash_files(outputs)}
+
+    def save(self) -> None:
+        temp_path = self.path.with_name(f"{self.path.name}.tmp")
+        with open(temp_path, "w", encoding="utf-8") as f:
+            f.write(json.dumps({"files": self.files, "nodes": self.nodes}))
+        os.replace(temp_path, self.path)
@@ -0,0 +1,110 @@
+import hashlib
+import os
+import time
+from pathlib import Path
+from typing import Optional
+
+from . import comptolib
+
+CACHE_FOLDER = Path(__file__).resolve().parents[2] / '.cache' / 'compto'
+DEFAULT_MAX_SIZE = 1 << 30
+
+
+def get_library_hash() -> str:
+    return hashlib.sha1(comptolib.comptolib_path.read_bytes()).hexdigest()[:12]
+
+
+class ComptoCache:
+    # Compressed files stored by (sha1 of the decompressed data, compto version)
+    # The mtime of each entry is its last use, the oldest ones are evicted
+    # when the folder goes over max_size
+    def __init__(self, folder: Path = CACHE_FOLDER, max_size: int = DEFAULT_MAX_SIZE) -> None:
+        # Entries made by another comptolib build are never reused
+        self.folder = Path(folder) / get_library_hash()
+        self.folder.mkdir(parents=True, exist_ok=True)
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+        self.entries: dict[str, tuple[int, int]] = {}
+        for entry in os.scandir(self.folder):
+            if entry.is_file() and entry.name.endswith('.bin'):
+                stat = entry.stat()
+                self.entries[entry.path] = (stat.st_mtime_ns, stat.st_size)
+        self.total_size = sum(size for _, size in self.entries.values())
+
+    def get_path(self, data, version: int) -> str:
+        return os.path.join(self.folder, f"{hashlib.sha1(data).hexdigest()}.{version}.bin")
+
+    def get(self, data, version: int) -> Optional[bytes]:
+        path = self.get_path(data, version)
+        try:
+            with open(path, 'rb') as f:
+                compressed = f.read()
+            os.utime(path)
+        except FileNotFoundError:
+            # Never stored or evicted by another process
+            self.remove(path)
+            return None
+
+        self.entries[path] = (time.time_ns(), len(compressed))
+        return compressed
+
+    def put(self, data, version: int, compressed) -> None:
+        path = self.get_path(data, version)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(temp_path, 'wb') as f:
+                f.write(compressed)
+            os.replace(temp_path, path)
+        except OSError:
+            return
+
+        self.remove(path)
+        self.entries[path] = (time.time_ns(), len(compressed))
+        self.total_size += len(compressed)
+        if self.total_size > self.max_size:
+            self.evict()
+
+    def remove(self, path: str) -> None:
+        if path in self.entries:
+            self.total_size -= self.entries.pop(path)[1]
+
+    def evict(self) -> None:
+        # Go down to 90% so that the next files don't evict every time
+        target = self.max_size * 9 // 10
+        for path, _ in sorted(self.entries.items(), key=lambda item: item[1][0]):
+            if self.total_size <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            self.remove(path)
+
+    def compress_data(self, data, version: int = 3, into: bytearray = None):
+        compressed = self.get(data, version)
+        if compressed is not None:
+            self.hits += 1
+            return compressed
+
+        self.misses += 1
+        compressed = comptolib.compress_data(data, version=version, into=into)
+        self.put(data, version, compressed)
+        return compressed
+
+
+default_cache: Optional[ComptoCache] = None
+
+
+def set_default_cache(folder: Path = CACHE_FOLDER, max_size: int = DEFAULT_MAX_SIZE) -> ComptoCache:
+    global default_cache
+    default_cache = ComptoCache(folder, max_size)
+    return default_cache
+
+
+def compress_data(data, version: int = 3, into: bytearray = None):
+    # Same as comptolib.compress_data, through the cache once it is set
+    if default_cache is None:
+        return comptolib.compress_data(data, version=version, into=into)
+    return default_cache.compress_data(data, version, into)
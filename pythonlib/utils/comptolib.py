@@ -103,41 +103,83 @@ class ComptoFile:
         return len(self.data)
 
 
-def compress_data(input: bytes, raw: bool = False, version: int = 3) -> bytes:
+HEADER_SIZE = 9
+header_struct = struct.Struct("<bLL")
+
+
+def get_pointer(data, offset: int = 0):
+    # Address of the data for the native functions, bytes and writable
+    # buffers are used in place, read-only views (mmap) are copied once
+    # The second value needs to stay alive during the call
+    if isinstance(data, bytes):
+        return ctypes.cast(ctypes.c_char_p(data), ctypes.c_void_p).value + offset, data
+    try:
+        buffer = (ctypes.c_char * len(data)).from_buffer(data)
+    except TypeError:
+        buffer = (ctypes.c_char * len(data)).from_buffer_copy(data)
+    return ctypes.addressof(buffer) + offset, buffer
+
+
+def get_output_buffer(size: int, into: bytearray = None) -> bytearray:
+    # The scratch buffer is grown in place when too small, no view
+    # returned by a previous call can be alive at this point
+    if into is None:
+        return bytearray(size)
+    if len(into) < size:
+        into.extend(bytes(size - len(into)))
+    return into
+
+
+def compress_data(input: bytes, raw: bool = False, version: int = 3, into: bytearray = None):
+    # Returns bytes, or a memoryview of `into` that is only valid until the next reuse
     input_size = len(input)
+    header_size = 0 if raw else HEADER_SIZE
     output_size = ((input_size * 9) // 8) + 10
-    output = b"\x00" * output_size
+    output = get_output_buffer(header_size + output_size, into)
+
+    input_pointer, input_keep = get_pointer(input)
+    output_pointer, output_keep = get_pointer(output, header_size)
     output_size = ctypes.c_uint(output_size)
-    error = compto_encode(version, input, input_size, output, ctypes.byref(output_size))
+    error = compto_encode(version, input_pointer, input_size, output_pointer, ctypes.byref(output_size))
+    del output_keep
     RaiseError(error)
 
+    # The header is written in front of the data, no concatenation
     if not raw:
-        output = (
-            struct.pack("<b", version)
-            + struct.pack("<L", output_size.value)
-            + struct.pack("<L", input_size)
-            + output[: output_size.value]
-        )
+        header_struct.pack_into(output, 0, version, output_size.value, input_size)
 
-    return output
+    view = memoryview(output)[: header_size + output_size.value]
+    return view if into is not None else view.tobytes()
 
 
-def decompress_data(input: bytes, raw: bool = False, version: int = 3) -> bytes:
+def decompress_data(input: bytes, raw: bool = False, version: int = 3, output_size: int = None, into: bytearray = None):
+    # Raw data has no header, the decompressed size needs to be given
+    # either with output_size or with the size of `into`
     if raw:
         input_size = len(input)
-        output_size = input_size * 10
+        header_size = 0
+        if output_size is None:
+            if into is None:
+                raise ValueError("output_size is needed to decompress raw data")
+            output_size = len(into)
     else:
-        version = struct.unpack("<b", input[:1])[0]
-        input_size, output_size = struct.unpack("<2L", input[1:9])
+        version, input_size, output_size = header_struct.unpack_from(input, 0)
+        header_size = HEADER_SIZE
 
-    output = b"\x00" * output_size
-    input = input[9:]
+    output = get_output_buffer(output_size, into)
 
-    error = compto_decode(
-        version, input, input_size, output, ctypes.byref(ctypes.c_uint(output_size))
-    )
+    input_pointer, input_keep = get_pointer(input, header_size)
+    output_pointer, output_keep = get_pointer(output)
+    decoded_size = ctypes.c_uint(output_size)
+    error = compto_decode(version, input_pointer, input_size, output_pointer, ctypes.byref(decoded_size))
+    del output_keep
     RaiseError(error)
-    return output
+
+    # The header size is the reference, raw data uses what was decoded
+    if raw:
+        output_size = decoded_size.value
+    view = memoryview(output)[:output_size]
+    return view if into is not None else view.tobytes()
 
 
 def compress_file(input: str, output: str, raw: bool = False, version: int = 3) -> None:
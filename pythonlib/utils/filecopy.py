@@ -0,0 +1,125 @@
+import os
+import shutil
+import sys
+from pathlib import Path
+
+from tqdm import tqdm
+
+# Copies done by the kernel when possible (reflink, copy_file_range, sendfile)
+# with a buffered fallback, progress is only updated every CHUNK_SIZE bytes
+CHUNK_SIZE = 64 * 1024 * 1024
+BUFFER_SIZE = 8 * 1024 * 1024
+FICLONE = 0x40049409
+
+
+def get_progress(total: int, desc: str = None):
+    if desc is None:
+        return None
+    return tqdm(total=total, desc=desc, unit="B", unit_divisor=1024, unit_scale=True, mininterval=0.5)
+
+
+def _kernel_copy(src_fd: int, dst_fd: int, src_pos: int, dst_pos: int, size: int, pbar) -> int:
+    copied = 0
+
+    if hasattr(os, "copy_file_range"):
+        try:
+            while copied < size:
+                n = os.copy_file_range(src_fd, dst_fd, min(CHUNK_SIZE, size - copied), src_pos + copied, dst_pos + copied)
+                if n == 0:
+                    break
+                copied += n
+                if pbar: pbar.update(n)
+        except OSError:
+            pass
+        if copied == size:
+            return copied
+
+    # sendfile writes at the current position of the destination
+    if hasattr(os, "sendfile") and sys.platform.startswith("linux"):
+        try:
+            os.lseek(dst_fd, dst_pos + copied, os.SEEK_SET)
+            while copied < size:
+                n = os.sendfile(dst_fd, src_fd, src_pos + copied, min(CHUNK_SIZE, size - copied))
+                if n == 0:
+                    break
+                copied += n
+                if pbar: pbar.update(n)
+        except OSError:
+            pass
+
+    return copied
+
+
+def copy_stream(src, dst, size: int, desc: str = None) -> int:
+    # Copy `size` bytes from the current position of src to the current
+    # position of dst, both binary files, positions are moved like read/write
+    pbar = get_progress(size, desc)
+    dst.flush()
+    src_pos = src.tell()
+    dst_pos = dst.tell()
+
+    try:
+        copied = 0
+        try:
+            copied = _kernel_copy(src.fileno(), dst.fileno(), src_pos, dst_pos, size, pbar)
+        except (AttributeError, OSError, ValueError):
+            # In memory files have no fileno
+            pass
+
+        src.seek(src_pos + copied)
+        dst.seek(dst_pos + copied)
+
+        buffer = bytearray(min(BUFFER_SIZE, max(size - copied, 0)))
+        view = memoryview(buffer)
+        while copied < size:
+            n = src.readinto(view[:min(len(buffer), size - copied)])
+            if not n:
+                break
+            dst.write(view[:n])
+            copied += n
+            if pbar: pbar.update(n)
+    finally:
+        if pbar: pbar.close()
+
+    return copied
+
+
+def copy_file(src: Path, dst: Path, desc: str = None) -> None:
+    # Same as shutil.copy, a reflink is tried first (btrfs, xfs...)
+    if os.path.isdir(dst):
+        dst = Path(dst) / Path(src).name
+
+    with open(src, "rb") as f_src, open(dst, "wb") as f_dst:
+        size = os.fstat(f_src.fileno()).st_size
+        cloned = False
+        if sys.platform.startswith("linux"):
+            try:
+                import fcntl
+                fcntl.ioctl(f_dst.fileno(), FICLONE, f_src.fileno())
+                cloned = True
+            except OSError:
+                pass
+
+        if not cloned:
+            copy_stream(f_src, f_dst, size, desc)
+
+    shutil.copymode(src, dst)
+
+
+def write_zeros(dst, size: int) -> None:
+    # Past the end of the file the zeros are made by extending it
+    dst.flush()
+    pos = dst.tell()
+    end = os.fstat(dst.fileno()).st_size
+
+    buffer = bytes(min(BUFFER_SIZE, size))
+    written = 0
+    while pos + written < end and written < size:
+        n = min(len(buffer), size - written, end - pos - written)
+        dst.write(buffer[:n])
+        written += n
+
+    if written < size:
+        dst.flush()
+        dst.truncate(pos + size)
+    dst.seek(pos + size)
@@ -0,0 +1,226 @@
+import struct
+
+# Nintendo LZ10/LZ11 codec, produces the same output as the bundled tools
+#   LZ10 -> lzss -evn (VRAM compatible, normal mode)
+#   LZ11 -> lzx -evb  (VRAM compatible, LZ-CUE optimization)
+LZ10 = 0x10
+LZ11 = 0x11
+
+LZ_THRESHOLD = 2          # max number of bytes to not encode
+LZ_N = 0x1000             # max offset
+LZ10_F = 0x12             # max coded LZ10
+LZ11_F = 0x10             # max coded with a 2 bytes LZ11 token
+LZ11_F1 = 0x110           # max coded with a 3 bytes LZ11 token
+LZ11_F2 = 0x10110         # max coded with a 4 bytes LZ11 token
+RAW_MAXIM = 0x00FFFFFF    # 3 bytes length in the header
+
+# VRAM can only be written 16 bits at a time, so a match can't
+# copy the byte that was just decoded (offset 1)
+VRAM_MIN_OFFSET = 2
+
+
+def _match_length(data: bytes, pos: int, candidate: int, known: int, limit: int) -> int:
+    # At least `known` bytes are already matching, find the real length
+    # Overlapping matches are allowed, the source is the raw data itself
+    if data[pos:pos + limit] == data[candidate:candidate + limit]:
+        return limit
+
+    low, high = known, limit - 1
+    while low < high:
+        middle = (low + high + 1) // 2
+        if data[pos:pos + middle] == data[candidate:candidate + middle]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+def _search(data: bytes, pos: int, max_length: int) -> tuple[int, int]:
+    # Longest match in the window, ties are won by the farthest offset
+    # like the brute-force SEARCH macro of the CUE tools
+    limit = min(max_length, len(data) - pos)
+    window_start = max(0, pos - LZ_N)
+    last_start = pos - VRAM_MIN_OFFSET
+
+    best_length, best_offset = LZ_THRESHOLD, 0
+    start = window_start
+    while best_length < limit and start <= last_start:
+        length = best_length + 1
+        candidate = data.find(data[pos:pos + length], start, last_start + length)
+        if candidate == -1:
+            break
+
+        best_length = _match_length(data, pos, candidate, length, limit)
+        best_offset = pos - candidate
+        start = candidate + 1
+
+    return best_length, best_offset
+
+
+def compress_lz10(data: bytes) -> bytes:
+    data = bytes(data)
+    raw_len = len(data)
+    if raw_len > RAW_MAXIM:
+        raise ValueError(f"File too big for LZ10 compression: {raw_len} bytes")
+
+    out = bytearray(struct.pack('<L', LZ10 | (raw_len << 8)))
+    pos = 0
+    mask = 0
+    flag_pos = 0
+    while pos < raw_len:
+        mask >>= 1
+        if not mask:
+            flag_pos = len(out)
+            out.append(0)
+            mask = 0x80
+
+        length, offset = _search(data, pos, LZ10_F)
+        if length > LZ_THRESHOLD:
+            out[flag_pos] |= mask
+            out += bytes((((length - (LZ_THRESHOLD + 1)) << 4) | ((offset - 1) >> 8), (offset - 1) & 0xFF))
+            pos += length
+        else:
+            out.append(data[pos])
+            pos += 1
+
+    return bytes(out)
+
+
+def compress_lz11(data: bytes) -> bytes:
+    data = bytes(data)
+    raw_len = len(data)
+    if raw_len > RAW_MAXIM:
+        raise ValueError(f"File too big for LZ11 compression: {raw_len} bytes")
+
+    out = bytearray(struct.pack('<L', LZ11 | (raw_len << 8)))
+    pos = 0
+    mask = 0
+    flag_pos = 0
+    while pos < raw_len:
+        mask >>= 1
+        if not mask:
+            flag_pos = len(out)
+            out.append(0)
+            mask = 0x80
+
+        length, offset = _search(data, pos, LZ11_F2)
+
+        # LZ-CUE optimization, use a literal if the next byte gives a better chain
+        if length > LZ_THRESHOLD and pos + length < raw_len:
+            length_next, _ = _search(data, pos + length, LZ11_F2)
+            length_post, _ = _search(data, pos + 1, LZ11_F2)
+
+            if length_next <= LZ_THRESHOLD:
+                length_next = 1
+            if length_post <= LZ_THRESHOLD:
+                length_post = 1
+            if length + length_next <= 1 + length_post:
+                length = 1
+
+        if length > LZ_THRESHOLD:
+            out[flag_pos] |= mask
+            pos += length
+            offset -= 1
+            if length > LZ11_F1:
+                length -= LZ11_F1 + 1
+                out += bytes((0x10 | (length >> 12), (length >> 4) & 0xFF,
+                              ((length & 0xF) << 4) | (offset >> 8), offset & 0xFF))
+            elif length > LZ11_F:
+                length -= LZ11_F + 1
+                out += bytes((length >> 4, ((length & 0xF) << 4) | (offset >> 8), offset & 0xFF))
+            else:
+                length -= 1
+                out += bytes(((length << 4) | (offset >> 8), offset & 0xFF))
+        else:
+            out.append(data[pos])
+            pos += 1
+
+    return bytes(out)
+
+
+def _copy_match(raw: bytearray, offset: int, length: int):
+    start = len(raw) - offset
+    if offset >= length:
+        raw += raw[start:start + length]
+    else:
+        # Overlapping copy, repeat the pattern
+        pattern = raw[start:]
+        raw += (pattern * (length // offset + 1))[:length]
+
+
+def decompress(data: bytes) -> bytes:
+    # Same lenient behaviour as the tools, stops at the end of the
+    # encoded data or when the expected size is reached
+    header = data[0]
+    if header not in (LZ10, LZ11):
+        raise ValueError(f"Data is not LZ10/LZ11 compressed (header 0x{header:02X})")
+
+    raw_len = struct.unpack_from('<L', data, 0)[0] >> 8
+    raw = bytearray()
+    pak = 4
+    pak_end = len(data)
+    mask = 0
+    flags = 0
+    while len(raw) < raw_len:
+        mask >>= 1
+        if not mask:
+            if pak == pak_end:
+                break
+            flags = data[pak]
+            pak += 1
+            mask = 0x80
+
+        if not flags & mask:
+            if pak == pak_end:
+                break
+            raw.append(data[pak])
+            pak += 1
+            continue
+
+        if header == LZ10:
+            if pak + 1 >= pak_end:
+                break
+            token = (data[pak] << 8) | data[pak + 1]
+            pak += 2
+            length = (token >> 12) + LZ_THRESHOLD + 1
+        else:
+            indicator = data[pak] >> 4
+            if indicator > 1:
+                if pak + 1 >= pak_end:
+                    break
+                token = (data[pak] << 8) | data[pak + 1]
+                pak += 2
+                length = indicator + 1
+            elif indicator == 0:
+                if pak + 2 >= pak_end:
+                    break
+                token = (data[pak] << 16) | (data[pak + 1] << 8) | data[pak + 2]
+                pak += 3
+                length = (token >> 12) + LZ11_F + 1
+            else:
+                if pak + 3 >= pak_end:
+                    break
+                token = struct.unpack_from('>L', data, pak)[0]
+                pak += 4
+                length = ((token >> 12) & 0xFFFF) + LZ11_F1 + 1
+
+        length = min(length, raw_len - len(raw))
+        offset = (token & 0xFFF) + 1
+        if offset > len(raw):
+            raise ValueError(f"Invalid LZ offset at 0x{pak:X}")
+        _copy_match(raw, offset, length)
+
+    return bytes(raw)
+
+
+def compress(data: bytes, c_type: str) -> bytes:
+    # c_type as found in the FPS4 files, 'LZ10' or 'LZ11'
+    if c_type == 'LZ10':
+        return compress_lz10(data)
+    elif c_type == 'LZ11':
+        return compress_lz11(data)
+    return bytes(data)
+
+
+def is_compressed(data: bytes) -> bool:
+    return len(data) >= 4 and data[0] in (LZ10, LZ11)
@@ -0,0 +1,29 @@
+from concurrent.futures import ProcessPoolExecutor
+
+# Pools are kept alive between calls, a story extraction goes
+# through hundreds of small archives
+executors = {}
+
+
+def get_executor(jobs: int) -> ProcessPoolExecutor:
+    # Only one pool at a time, the one of another jobs value is closed
+    if jobs not in executors:
+        shutdown_executors()
+        executors[jobs] = ProcessPoolExecutor(max_workers=jobs)
+    return executors[jobs]
+
+
+def shutdown_executors() -> None:
+    # Called once the command is done, the workers are not left to atexit
+    for executor in executors.values():
+        executor.shutdown()
+    executors.clear()
+
+
+def map_jobs(func, *iterables, jobs: int = 1) -> list:
+    # Same as map, in a process pool when jobs > 1
+    # The results always keep the order of the inputs
+    items = [list(iterable) for iterable in iterables]
+    if jobs > 1 and len(items[0]) > 1:
+        return list(get_executor(jobs).map(func, *items))
+    return list(map(func, *items))